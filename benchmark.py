@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#бенчмарк image_processor: создает синтетический корпус (prepare_images.generate_corpus) и прогоняет
+#обработку по всем сочетаниям числа потребителей, цепочек обработки и режимов выполнения.
+#каждый прогон - отдельный процесс, чтобы пиковая память одного прогона не влияла на другой.
+#результаты пишутся в JSON, который можно сравнить с прошлым запуском через --compare
+import argparse #параметры командной строки
+import itertools #перебор всех сочетаний параметров
+import json #машиночитаемый отчет
+import os
+import platform #описание машины в отчете
+import shutil #очистка папки результатов между прогонами
+import subprocess #запуск прогона в отдельном процессе
+import sys
+import tempfile #временный файл для результата дочернего процесса
+import time
+
+try:
+    import resource #пиковая память процесса (только Unix)
+except ImportError:
+    resource = None
+
+import image_processor as ip
+import prepare_images
+
+
+#пиковая память в КБ: своя и самого большого дочернего процесса (пул процессов)
+def peak_rss_kb():
+    if resource is None:
+        return None, None
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == "darwin": #macOS отдает байты, Linux - килобайты
+        own, children = own // 1024, children // 1024
+    return own, children
+
+
+#один прогон - выполняется в дочернем процессе
+def run_one(config):
+    shutil.rmtree(config["output"], ignore_errors=True) #каждый прогон пишет результаты заново
+    consumers = config["consumers"]
+    #в конвейере число потребителей задает размер вычислительных этапов
+    pipeline_workers = {"decode": consumers, "transform": consumers, "encode": consumers}
+    collector, wall_time, cores = ip.run_batch(
+        config["corpus"], config["output"], ip.parse_operations(config["operations"]),
+        mode=ip.ProducerMode.ALL, num_consumers=consumers,
+        execution=ip.ExecutionMode(config["execution"]), pipeline_workers=pipeline_workers)
+    
+    latencies = [r.process_time for r in collector.results]
+    successful = sum(1 for r in collector.results if r.success)
+    own_rss, children_rss = peak_rss_kb()
+    return dict(
+        config,
+        images=len(collector.results),
+        failed=len(collector.results) - successful,
+        wall_time=wall_time,
+        throughput=len(collector.results) / wall_time if wall_time else 0.0, #изображений в секунду
+        throughput_per_core=len(collector.results) / wall_time / cores if wall_time else 0.0,
+        cores=cores,
+        latency_p50=ip.percentile(latencies, 50),
+        latency_p95=ip.percentile(latencies, 95),
+        latency_p99=ip.percentile(latencies, 99),
+        peak_rss_kb=own_rss,
+        peak_rss_children_kb=children_rss,
+        stages=collector.metrics.snapshot()["latency"], #p50/p95/p99 ожидания в очереди и каждого этапа
+    )
+
+
+#ключ прогона для сравнения отчетов
+def run_key(run):
+    return (run["execution"], run["operations"], run["consumers"])
+
+
+def compare(old_report, runs):
+    old = {}
+    for run in old_report["runs"]:
+        old.setdefault(run_key(run), []).append(run)
+    print("\nСравнение с прошлым отчетом (пропускная способность, p95):")
+    for run in runs:
+        previous = old.get(run_key(run))
+        if not previous:
+            continue
+        before = sum(r["throughput"] for r in previous) / len(previous)
+        p95_before = sum(r["latency_p95"] for r in previous) / len(previous)
+        change = (run["throughput"] / before - 1) * 100 if before else 0.0
+        print(f"  {run['execution']:<10} {run['operations']:<24} consumers={run['consumers']:<3} "
+              f"{before:8.2f} -> {run['throughput']:8.2f} изобр/с ({change:+.1f}%), "
+              f"p95 {p95_before * 1000:.1f} -> {run['latency_p95'] * 1000:.1f} мс")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк параллельной обработки изображений")
+    parser.add_argument("--corpus", default="bench_corpus", help="папка корпуса")
+    parser.add_argument("--reuse-corpus", action="store_true", help="не пересоздавать корпус, если папка уже есть")
+    parser.add_argument("--count", type=int, default=100, help="изображений в корпусе")
+    parser.add_argument("--min-size", type=prepare_images.parse_size, default=(640, 480))
+    parser.add_argument("--max-size", type=prepare_images.parse_size, default=(1920, 1080))
+    parser.add_argument("--formats", default="PNG,JPEG")
+    parser.add_argument("--modes", default="RGB")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--consumers", default="1,2,4", help="числа потребителей через запятую")
+    parser.add_argument("--operations", default="invert;blur;mirror",
+                        help="цепочки через ';', шаги цепочки через '+', например invert;blur:radius=3+mirror")
+    parser.add_argument("--executions", default="threads,processes,pipeline", help="режимы выполнения через запятую")
+    parser.add_argument("--repeat", type=int, default=1, help="повторов каждого прогона")
+    parser.add_argument("--output", default="bench_results.json", help="файл отчета")
+    parser.add_argument("--compare", help="прошлый отчет для сравнения")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS) #служебный: конфигурация одного прогона в JSON
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    
+    if args.run_one: #дочерний процесс
+        result = run_one(json.loads(args.run_one))
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return
+    
+    reused = args.reuse_corpus and os.path.isdir(args.corpus)
+    if not reused:
+        shutil.rmtree(args.corpus, ignore_errors=True)
+        prepare_images.generate_corpus(args.corpus, args.count, args.min_size, args.max_size,
+                                       args.formats.split(","), args.modes.split(","),
+                                       args.duplicate_ratio, args.seed)
+    
+    output_folder = args.corpus.rstrip("/\\") + "_output"
+    runs = []
+    combinations = itertools.product(
+        args.executions.split(","),
+        [op for op in args.operations.split(";") if op],
+        [int(c) for c in args.consumers.split(",")])
+    for execution, operations, consumers in combinations:
+        config = {"corpus": args.corpus, "output": output_folder, "execution": execution,
+                  "operations": operations, "consumers": consumers}
+        for attempt in range(args.repeat):
+            fd, result_file = tempfile.mkstemp(suffix=".json")
+            os.close(fd)
+            try:
+                subprocess.run([sys.executable, os.path.abspath(__file__), "--run-one", json.dumps(config),
+                                "--result-file", result_file],
+                               stdout=subprocess.DEVNULL, check=True) #вывод обработки не нужен
+                with open(result_file, encoding="utf-8") as f:
+                    run = json.load(f)
+            finally:
+                os.remove(result_file)
+            run["attempt"] = attempt
+            runs.append(run)
+            print(f"{execution:<10} {operations:<24} consumers={consumers:<3} "
+                  f"{run['throughput']:8.2f} изобр/с  p50 {run['latency_p50'] * 1000:7.1f} мс  "
+                  f"p99 {run['latency_p99'] * 1000:7.1f} мс  RSS {run['peak_rss_kb']} КБ")
+    shutil.rmtree(output_folder, ignore_errors=True)
+    
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "corpus": {"folder": args.corpus, "count": args.count, "min_size": args.min_size,
+                       "max_size": args.max_size, "formats": args.formats, "modes": args.modes,
+                       "duplicate_ratio": args.duplicate_ratio, "seed": args.seed,
+                       "reused": reused}, #корпус с прошлого запуска - параметры выше могут не совпадать
+        },
+        "runs": runs,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nОтчет сохранен: {args.output}")
+    
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), runs)
+
+
+if __name__ == "__main__":
+    main()
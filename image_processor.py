@@ -1,29 +1,127 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import threading #модуль для многопоточности - позволяет создавать и управлять потоками. нужен для параллельной обработки нескольких изобр.
-import queue #потокобезопасная очередь для передачи задач между потоками. производители кладут задачи, потребители забирают. FIFO 
 import os #работа с os - для работы с файловой системой: проверка существования файлов, создание папок, пути
 import time #для задержек, измерения времени выполнения, создания временных меток 
 from PIL import Image, ImageFilter #импортируем из библиотеки обработки изображений основной класс Image - открыть, сохранить, преобразовать изображения
 #ImageFilter - применять эффекты (размытие и тд) 
-from dataclasses import dataclass #декоратор для классов данных - автоматически генерирует __init__, __repr__ и другие методы для классов, которые в основном хранят данные
+from dataclasses import dataclass, field, asdict #asdict - результат в словарь для передачи по сети, field - значения по умолчанию для изменяемых полей (списки, словари). декоратор для классов данных - автоматически генерирует __init__, __repr__ и другие методы для классов, которые в основном хранят данные
 from enum import Enum #для создания ограниченного набора констант (типы обработки) 
 import random #для выбора случайных изображений
-from datetime import datetime #работа с датой/временем - для логирования, временных меток, измерения времени выполнения
+import itertools #общий счетчик номеров задач для нескольких производителей
+import contextlib #redirect_stdout - статистика в stderr при выводе результатов в JSON
+from contextlib import contextmanager #замер времени этапа через with
+import multiprocessing #контекст запуска дочерних процессов для пула
+from multiprocessing import shared_memory #разделяемая память - передача пикселей между процессами без pickle
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor #Future - ожидание записи пачки PackSink, пул процессов - обход GIL для CPU-тяжелой обработки, пул потоков - полосы большого изображения
+import math #расчет перекрытия полос для размытия
+import logging #журнал работы с уровнями: по умолчанию молчит, подробности включаются уровнем DEBUG
+import json #выгрузка метрик в JSON
+import hashlib #хэш содержимого файла - ключ кэша результатов
+import io #буфер в памяти - кодирование изображения в байты без записи на диск
+from collections import OrderedDict, deque #словарь с порядком - основа LRU-кэша, deque - хранилище очереди
+import heapq #куча - очередь с приоритетами
+import asyncio #асинхронный итератор результатов
+import argparse #параметры командной строки (запуск без вопросов)
+import sys
+import mmap #отображение файла-архива в память - чтение исходников без системных вызовов на каждый файл
+import tempfile #временные файлы для больших изображений, которые не должны занимать память процесса
+import tarfile #исходники из tar-архива
+import zipfile #исходники из zip-архива
+import struct #разбор локального заголовка zip - где начинаются данные файла
+
+logger = logging.getLogger("image_processor") #все сообщения потоков идут сюда, а не в print
 
 #варианты обработки изображений
 class ProcessingType(Enum):
     INVERT = "invert"      #инверсия
     BLUR = "blur"          #размытие
     MIRROR = "mirror"      #отражение
+    GAMMA = "gamma"        #гамма-коррекция
+    LUT = "lut"            #произвольная таблица значений (256 чисел)
+
+#параметры по умолчанию для каждого типа обработки
+DEFAULT_PARAMS = {
+    ProcessingType.BLUR: {"radius": 2},
+    ProcessingType.GAMMA: {"gamma": 1.0},
+}
+
+#какие параметры есть у каждого типа: опечатка ("blur:rad=3") иначе молча дала бы радиус по умолчанию
+#под новым именем результата
+KNOWN_PARAMS = {
+    ProcessingType.BLUR: {"radius"},
+    ProcessingType.GAMMA: {"gamma"},
+    ProcessingType.LUT: {"table"},
+}
+
+#поточечные операции: новое значение пикселя зависит только от старого значения,
+#поэтому несколько таких шагов подряд можно свести в одну таблицу и применить за один проход
+POINT_OPERATIONS = (ProcessingType.INVERT, ProcessingType.GAMMA, ProcessingType.LUT)
+
+#как производитель выбирает исходники
+class ProducerMode(Enum):
+    RANDOM = "random"      #случайная выборка num_images файлов (с повторами)
+    ALL = "all"            #каждый найденный файл ровно один раз, по мере обхода папок
+
+#где выполняется обработка
+class ExecutionMode(Enum):
+    THREADS = "threads"        #потоки Consumer в одном процессе
+    PROCESSES = "processes"    #потоки Consumer + эффекты в пуле процессов
+    PIPELINE = "pipeline"      #конвейер по этапам со своими пулами потоков
+
+#порядок выдачи задач из очереди
+class SchedulingMode(Enum):
+    FIFO = "fifo"              #в порядке поступления
+    PRIORITY = "priority"      #сначала больший priority, при равном - раньший deadline
+    COST = "cost"              #как PRIORITY, но мелкие задачи обгоняют крупные (оценка по заголовку изображения)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.tif', '.tiff', '.bmp') #какие файлы считаются изображениями
+
+MAP_FILE_BYTES = 16 * 1024 * 1024 #исходники от этого размера отображаются в память, а не читаются целиком
+
+#предел размера исходника в пикселях (защита от «бомб» - файла с заголовком на миллиарды пикселей).
+#проверяется при каждом открытии (open_image), а не глобальным Image.MAX_IMAGE_PIXELS: гигапиксельные
+#сканы обрабатываются полосами и стандартный предел PIL (~89 Мп) для них слишком мал. None - без предела
+DEFAULT_MAX_PIXELS = 1 << 32
+
+#этапы обработки одной задачи по порядку - по ним замеряется время в TaskResult.stage_times
+STAGES = ("read", "decode", "transform", "encode", "write")
+
+@dataclass
+class Operation: #один шаг цепочки обработки с параметрами
+    type: ProcessingType
+    params: dict = field(default_factory=dict) #например {"radius": 5} для размытия
 
 @dataclass #python автоматически создает конструктор и другие методы при наличии декоратора 
 class ImageTask: #представляет одну задачу на обработку
     task_id: int #id задачи 
     input_path: str #путь к исходному файлу - откуда брать изображения
     output_path: str #путь для результата - куда сохранить обработанное изображение
-    process_type: ProcessingType #вариант обработки
+    process_type: ProcessingType #вариант обработки (первый шаг цепочки)
     created_time: float #время создания
+    operations: list = None #цепочка Operation - выполняется по порядку над одним декодированным изображением
+    source: str = None #архив или пакет, внутри которого лежит input_path (None - обычный файл на диске)
+    input_stat: list = None #[размер, mtime в нс] исходника на момент создания задачи - для журнала выполненных
+    priority: int = 0 #больше - важнее (учитывается очередью PriorityBlockingQueue)
+    deadline: float = None #к какому моменту (time.time()) нужен результат, None - без срока
+    
+    def __post_init__(self): #вызывается после автоматически созданного __init__
+        if not self.operations:
+            self.operations = normalize_operations(self.process_type)
+    
+    def to_dict(self): #для передачи по сети (JSON): перечисления - строками
+        return {"task_id": self.task_id, "input_path": self.input_path, "output_path": self.output_path,
+                "process_type": self.process_type.value, "created_time": self.created_time,
+                "operations": [{"type": op.type.value, "params": op.params} for op in self.operations],
+                "source": self.source, "input_stat": self.input_stat, "priority": self.priority,
+                "deadline": self.deadline}
+    
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data["process_type"] = ProcessingType(data["process_type"])
+        data["operations"] = [Operation(ProcessingType(op["type"]), op["params"]) for op in data["operations"]]
+        return cls(**data)
 
 @dataclass
 class TaskResult: #хранит информацию о результате обработки одной задачи 
@@ -32,138 +130,1674 @@ class TaskResult: #хранит информацию о результате о
     message: str #текстовое сообщение (описание ошибки или "успешно")
     process_time: float
     consumer_id: int
+    cache_hit: bool = False #результат взят из кэша, а не посчитан заново
+    stage_times: dict = field(default_factory=dict) #этап ("read", "decode", ...) -> секунды
+    queue_wait: float = 0.0 #сколько задача ждала в очереди от создания до начала обработки
+    priority: int = 0 #приоритет задачи - для задержек по классам приоритета
+    deadline: float = None
+    deadline_missed: bool = False #результат готов позже deadline
+    digest: str = None #sha256 исходника сохраненного результата - координатор по нему ведет журнал выполненных
+    
+    def to_dict(self):
+        return asdict(self)
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
 
-class BlockingQueue: #класс для расширения стандартной очереди queue.Queue добавляя флаг активности, логирование 
-    def __init__(self, maxsize=0): #self - ссылка на создаваемый объект, параметр со значением по умолчанию 0
-        self.queue = queue.Queue(maxsize)  #создание внутренней очереди, self.queue - создает атрибут объекта с именем queue
-        #queue.Queue - обращается к классу Queue из импортированного модуля queue, (maxsize) - передает параметр размера в конструктор Queue 
-        self.active = True #установка флага активности - создает атрибут active со значение True. Очередь изначально открыта
-    
-    def put(self, item): #определение метода put для добавления элемента， item - параметр， элемент для добавления в очередь
-        if not self.active:
-            raise Exception("Очередь закрыта")
-        self.queue.put(item) #self.queue - обращение к внутренней очереди, put(item) - вызов метода put стандартной очереди
-        #элемент добавляется в очередь (блокирующая операция если очередь полна)
-        print(f"  [Queue] + Добавлен элемент. Очередь: {self.queue.qsize()}") 
-     
-    def get(self):  #определение метода get для извлечения элемента
+#приводит описание обработки к списку Operation с заполненными параметрами.
+#принимает ProcessingType, Operation, строку вида "blur:radius=3" или список из них
+#параметры приводятся к одному типу: blur и blur:radius=2 (int из DEFAULT_PARAMS против float из строки)
+#должны давать одинаковые operations_id и ключи кэша
+def _normalize_param(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (list, tuple)): #таблица LUT - список целых (после JSON tuple становится list)
+        return [int(v) for v in value]
+    return value
+
+
+#ошибка в параметрах - сразу при разборе цепочки, а не в каждой задаче
+def _validate_params(op_type, params):
+    unknown = sorted(set(params) - KNOWN_PARAMS.get(op_type, set()))
+    if unknown:
+        raise ValueError(f"Неизвестные параметры {op_type.value}: {', '.join(unknown)}")
+    if op_type == ProcessingType.GAMMA and not params["gamma"] > 0:
+        raise ValueError(f"Гамма должна быть больше 0: {params['gamma']}")
+    if op_type == ProcessingType.BLUR and not params["radius"] >= 0:
+        raise ValueError(f"Радиус размытия не может быть отрицательным: {params['radius']}")
+    if op_type == ProcessingType.LUT and len(params.get("table", ())) != 256:
+        raise ValueError("Таблица LUT должна содержать 256 значений")
+
+
+def normalize_operations(spec):
+    if isinstance(spec, str): #цепочка "invert+blur:radius=3" - шаги через "+"
+        spec = [item for item in spec.split("+") if item.strip()]
+    if not isinstance(spec, (list, tuple)):
+        spec = [spec]
+    
+    operations = []
+    for item in spec:
+        if isinstance(item, str):
+            name, _, args = item.partition(":") #"blur:radius=3" -> "blur", "radius=3"
+            params = {}
+            for arg in filter(None, args.split(",")):
+                key, _, value = arg.partition("=")
+                params[key.strip()] = float(value)
+            item = Operation(ProcessingType(name.strip().lower()), params)
+        elif isinstance(item, ProcessingType):
+            item = Operation(item)
+        elif not isinstance(item, Operation):
+            raise ValueError(f"Неизвестный тип: {item}")
+        
+        params = dict(DEFAULT_PARAMS.get(item.type, {}))
+        params.update(item.params)
+        params = {key: _normalize_param(value) for key, value in params.items()}
+        _validate_params(item.type, params)
+        operations.append(Operation(item.type, params))
+    
+    if not operations:
+        raise ValueError("Пустая цепочка обработки")
+    return operations
+
+
+#цепочка из командной строки: шаги через "+", параметры после ":" через ",".
+#например "invert+blur:radius=3+mirror"
+def parse_operations(text):
+    return normalize_operations(text)
+
+
+#короткое имя цепочки для имени выходного файла: invert-blur-mirror
+def operations_label(operations):
+    return "-".join(op.type.value for op in operations)
+
+
+#короткий хэш цепочки вместе с параметрами: blur:radius=2 и blur:radius=5 дают разные имена результатов
+def operations_id(operations):
+    digest = hashlib.sha256()
+    for op in operations:
+        digest.update(op.type.value.encode())
+        digest.update(repr(sorted(op.params.items())).encode())
+    return digest.hexdigest()[:8]
+
+
+#таблица для одной поточечной операции: table[x] - новое значение для старого значения x
+def _point_table(op):
+    if op.type == ProcessingType.INVERT:
+        return [255 - x for x in range(256)]
+    if op.type == ProcessingType.GAMMA:
+        gamma = op.params["gamma"]
+        return [round(255 * (x / 255) ** (1 / gamma)) for x in range(256)]
+    if op.type == ProcessingType.LUT:
+        table = [int(v) for v in op.params["table"]]
+        if len(table) != 256:
+            raise ValueError("Таблица LUT должна содержать 256 значений")
+        return table
+    raise ValueError(f"Не поточечная операция: {op.type}")
+
+
+#сливает соседние поточечные шаги в один LUT: invert + gamma + lut -> один проход по пикселям.
+#остальные шаги (размытие, отражение) остаются как есть
+def fuse_operations(operations):
+    fused = []
+    for op in operations:
+        if op.type not in POINT_OPERATIONS:
+            fused.append(op)
+            continue
+        table = _point_table(op)
+        if fused and fused[-1].type == ProcessingType.LUT:
+            previous = fused[-1].params["table"]
+            table = [table[v] for v in previous] #композиция: сначала предыдущая таблица, потом текущая
+            fused[-1] = Operation(ProcessingType.LUT, {"table": table})
+        else:
+            fused.append(Operation(ProcessingType.LUT, {"table": table}))
+    return fused
+
+
+#поточечные операции работают в RGB (как и раньше инверсия), поэтому режим меняется один раз до цепочки.
+#после этого все шаги сохраняют и режим, и размер изображения
+def prepare_for_operations(img, operations):
+    if img.mode != 'RGB' and any(op.type in POINT_OPERATIONS for op in operations):
+        return img.convert('RGB')
+    return img
+
+
+#применяет всю цепочку к одному декодированному изображению. вынесено из Consumer на уровень модуля,
+#чтобы эту же функцию можно было вызвать в дочернем процессе пула (методы потока в другой процесс не передать)
+def apply_operations(img, operations):
+    img = prepare_for_operations(img, operations)
+    
+    for op in fuse_operations(operations):
+        if op.type == ProcessingType.LUT:
+            #инверсия, гамма и таблицы - одним проходом
+            img = img.point(op.params["table"] * len(img.getbands())) #таблица на каждый канал
+        
+        elif op.type == ProcessingType.BLUR:
+            #размытие
+            img = img.filter(ImageFilter.GaussianBlur(radius=op.params["radius"]))
+        
+        elif op.type == ProcessingType.MIRROR:
+            #отражение
+            img = img.transpose(Image.FLIP_LEFT_RIGHT)
+        
+        else:
+            raise ValueError(f"Неизвестный тип: {op.type}")
+    
+    return img
+
+
+#выполняется в дочернем процессе: пиксели лежат в разделяемой памяти shm_name,
+#результат записывается туда же. через pickle передаются только имя блока, режим и размер
+def _process_shared(shm_name, mode, size, operations):
+    shm = shared_memory.SharedMemory(name=shm_name) #подключение к уже созданному блоку
+    try:
+        img = Image.frombytes(mode, size, shm.buf) #собираем изображение прямо из разделяемой памяти
+        processed = apply_operations(img, operations)
+        data = processed.tobytes()
+        if len(data) > shm.size:
+            raise ValueError("Результат не помещается в разделяемую память")
+        shm.buf[:len(data)] = data #результат пишем поверх исходных пикселей
+        return processed.mode, processed.size, len(data)
+    finally:
+        shm.close() #отключаемся от блока, удаляет его родительский процесс
+
+
+#вся обработка одной задачи в дочернем процессе: декодирование, цепочка и кодирование вне GIL потоков Consumer.
+#туда и обратно передаются сжатые байты, а не пиксели. возвращает (байты результата, время по этапам)
+def _render_in_process(data, operations, fmt, max_pixels=DEFAULT_MAX_PIXELS):
+    times = {}
+    with stage_timer(times, "decode"):
+        img = decode_image(data, max_pixels)
+    with stage_timer(times, "transform"):
+        processed = apply_operations(img, operations)
+    with stage_timer(times, "encode"):
+        encoded = encode_image(processed, fmt)
+    return encoded, times
+
+
+class ProcessBackend: #пул процессов для обработки: каждый процесс со своим GIL, поэтому эффекты реально выполняются параллельно
+    def __init__(self, num_workers=None):
+        self.num_workers = num_workers or os.cpu_count() or 1 #по умолчанию - по процессу на ядро
+        #spawn вместо fork: процессы создаются из уже работающих потоков Consumer, fork в такой ситуации небезопасен
+        context = multiprocessing.get_context("spawn")
+        self.executor = ProcessPoolExecutor(max_workers=self.num_workers, mp_context=context)
+        logger.info("[BACKEND] Пул процессов: %d", self.num_workers)
+    
+    def render(self, data, operations, fmt, max_pixels=DEFAULT_MAX_PIXELS): #исходные байты -> закодированный результат, всё в пуле процессов
+        return self.executor.submit(_render_in_process, bytes(data), operations, fmt, max_pixels).result()
+    
+    #только цепочка над уже декодированным изображением - для полос TiledProcessor
+    def transform(self, img, operations): #вызывается из потока Consumer, блокирует только этот поток
+        img = prepare_for_operations(img, operations) #приводим режим заранее, чтобы результат занял столько же байт, сколько исходник
+        data = img.tobytes() #декодированные пиксели
+        shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
         try:
-            item = self.queue.get(timeout=0.1) #метод извлечения из очереди, ждать не больше 0.1 секунды если очередь пуста
-            print(f"  [Queue] - Извлечен элемент. Очередь: {self.queue.qsize()}") 
-            return item
-        except queue.Empty: #если вдруг очередь пуста, то выводится ошибка и никакой элемент не возвращается
+            shm.buf[:len(data)] = data
+            future = self.executor.submit(_process_shared, shm.name, img.mode, img.size, operations)
+            mode, size, nbytes = future.result() #ждем дочерний процесс
+            return Image.frombytes(mode, size, bytes(shm.buf[:nbytes]))
+        finally:
+            shm.close()
+            shm.unlink() #освобождаем блок
+    
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+#сколько строк размывает GaussianBlur в каждую сторону. PIL делает размытие тремя проходами
+#прямоугольного фильтра, радиус прохода считается так же, как в самой PIL (_gaussian_blur_radius)
+def blur_halo(radius, passes=3):
+    sigma2 = radius * radius / passes
+    L = math.sqrt(12.0 * sigma2 + 1.0)
+    l = math.floor((L - 1.0) / 2.0)
+    a = (2 * l + 1) * (l * (l + 1) - 3 * sigma2)
+    a /= 6 * (sigma2 - (l + 1) * (l + 1))
+    return passes * (math.floor(l + a) + 1) #каждый проход дотягивается на целую часть радиуса плюс одну строку
+
+
+#перекрытие полос для всей цепочки: размытия складываются, остальные шаги соседей не используют
+def operations_halo(operations):
+    return sum(blur_halo(op.params["radius"]) for op in operations if op.type == ProcessingType.BLUR)
+
+
+#режимы, которые PIL может разместить в чужом буфере: режим -> байт на пиксель в памяти PIL (RGB хранится как RGBX)
+SPILL_PIXEL_BYTES = {"L": 1, "RGB": 4, "RGBA": 4, "CMYK": 4, "I": 4, "F": 4}
+
+
+class SpillImage: #полноразмерное изображение во временном файле, отображенном в память
+    #страницы такого изображения ядро само пишет на диск и вытесняет, поэтому гигапиксельный исходник или
+    #результат не занимает анонимную память процесса и не приводит к OOM. режимы не из SPILL_PIXEL_BYTES - в памяти
+    def __init__(self, mode, size, folder=None):
+        self.map = None
+        if mode not in SPILL_PIXEL_BYTES:
+            self.image = Image.new(mode, size)
+            return
+        self.stride = size[0] * SPILL_PIXEL_BYTES[mode] #байт на строку - как у PIL
+        length = max(self.stride * size[1], 1)
+        with tempfile.TemporaryFile(dir=folder) as f: #имени у файла нет - место освободится вместе с отображением
+            f.truncate(length)
+            self.map = mmap.mmap(f.fileno(), length)
+        #так делает Image.frombuffer для режимов L/RGBA/..., но он не умеет RGB. изображение не только для чтения:
+        #paste и декодер пишут прямо в файл, а save не делает копию
+        self.image = Image.new(mode, (0, 0))._new(Image.core.map_buffer(self.map, size, "raw", 0, (mode, self.stride, 1)))
+    
+    def paste(self, piece, top): #строки piece на место top.. и сразу отпускаем записанные страницы
+        self.image.paste(piece, (0, top))
+        if self.map is not None:
+            self.release(top * self.stride, (top + piece.height) * self.stride)
+    
+    def release(self, start, end): #страницы остаются в файле (кэше ядра), но не в памяти процесса
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        start = -(-start // mmap.PAGESIZE) * mmap.PAGESIZE #только целиком записанные страницы
+        end = min(end, len(self.map)) // mmap.PAGESIZE * mmap.PAGESIZE
+        if end > start:
+            self.map.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
+#декодирование целиком, но в SpillImage: для форматов, которые не читаются по строкам (PNG, JPEG, TIFF со сжатием)
+def decode_spilled(data, max_pixels=DEFAULT_MAX_PIXELS, folder=None):
+    reader = MemoryReader(data)
+    img = open_image(reader, max_pixels)
+    spill = None
+    if img.mode in SPILL_PIXEL_BYTES:
+        spill = SpillImage(img.mode, img.size, folder)
+        img.im = spill.image.im #load() не создает свой буфер, если он уже есть - декодер пишет строки в файл
+    img.load()
+    reader.close()
+    if spill is not None:
+        spill.release(0, len(spill.map))
+    return img
+
+
+#как encode_image, но во временный файл: сжатый результат большого изображения тоже не держим в памяти.
+#возвращает отображение файла только для чтения - приемники и кэш принимают его как байты
+def encode_spilled(img, fmt, folder=None):
+    with tempfile.TemporaryFile(dir=folder) as f:
+        img.save(f, format=fmt) #кодировщик пишет в файл порциями
+        size = f.tell()
+        if size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+
+class RawStrips: #несжатый исходник (TIFF без сжатия, BMP, PPM...) как источник полос для TiledProcessor.apply
+    #строки лежат в файле по известным смещениям, поэтому crop декодирует только запрошенные строки прямо из байтов
+    #файла - декодированное изображение целиком не появляется. size, mode и crop - как у Image
+    def __init__(self, data, mode, size, tiles, max_pixels):
+        self.data = data
+        self.mode = mode
+        self.size = size
+        self.width, self.height = size
+        self.tiles = tiles #(первая строка, конец, смещение, параметры raw-декодера, байт на строку в файле)
+        self.max_pixels = max_pixels
+    
+    def getbands(self): #для image_nbytes
+        return Image.getmodebandnames(self.mode)
+    
+    @classmethod
+    def open(cls, data, max_pixels=DEFAULT_MAX_PIXELS): #RawStrips или None, если формат так не читается
+        reader = MemoryReader(data)
+        try:
+            with open_image(reader, max_pixels) as img:
+                tiles = cls._row_tiles(img)
+                if tiles is None:
+                    return None
+                return cls(data, img.mode, img.size, tiles, max_pixels)
+        finally:
+            reader.close()
+    
+    @staticmethod
+    def _row_tiles(img):
+        tiles = []
+        for codec, (x0, y0, x1, y1), offset, args in img.tile:
+            if codec != "raw" or x0 != 0 or x1 != img.width: #сжатие или плитки не на всю ширину
+                return None
+            if isinstance(args, str):
+                args = (args,)
+            rawmode, stride, ystep = (tuple(args) + (0, 1))[:3]
+            row_bytes = stride
+            if row_bytes <= 0: #строки без выравнивания - длина как у упакованной строки
+                try:
+                    row_bytes = len(Image.new(img.mode, (img.width, 1)).tobytes("raw", rawmode))
+                except (ValueError, OSError):
+                    return None
+            tiles.append((y0, y1, offset, (rawmode, stride, ystep), row_bytes))
+        return tiles
+    
+    def crop(self, box):
+        left, top, right, bottom = box
+        reader = MemoryReader(self.data)
+        img = open_image(reader, self.max_pixels)
+        tiles = []
+        for y0, y1, offset, args, row_bytes in self.tiles:
+            start, end = max(y0, top), min(y1, bottom)
+            if start >= end:
+                continue
+            skip = y1 - end if args[2] < 0 else start - y0 #ystep < 0 - строки записаны снизу вверх (BMP)
+            tiles.append(("raw", (0, start - top, self.width, end - top), offset + skip * row_bytes, args))
+        img.tile = tiles
+        img._size = (self.width, bottom - top) #декодер заполняет только полосу
+        img.im = Image.core.new(self.mode, img._size) #TIFF сам выделил бы буфер под полный размер (_tile_size)
+        img.load()
+        reader.close()
+        if (left, right) != (0, self.width):
+            return img.crop((left, 0, right, bottom - top))
+        return img
+
+
+class TiledProcessor: #обработка больших изображений горизонтальными полосами с ограничением памяти на полосу
+    #полосы на всю ширину: отражение по горизонтали и поточечные шаги работают с полосой как с целым изображением,
+    #а для размытия полоса берется с перекрытием (halo), поэтому результат совпадает с обработкой целиком.
+    #полосы одного изображения обрабатываются параллельно в общем пуле (PIL отпускает GIL внутри фильтров).
+    #memory_limit - на все полосы в работе сразу (у всех потребителей): одновременно в работе не больше
+    #num_workers полос, и каждой достается memory_limit / num_workers.
+    #полноразмерные данные в этот лимит не входят и в памяти процесса не лежат (apply_data + encode):
+    #несжатый исходник читается по строкам прямо из файла (RawStrips), остальные форматы декодируются
+    #во временный файл (SpillImage), результат собирается и кодируется тоже во временные файлы.
+    #в памяти остаются только полосы в работе; файлы в spill_dir (по умолчанию - папка временных файлов)
+    #должны быть на диске, а не в tmpfs, иначе их страницы тоже займут память
+    WORKING_COPIES = 3 #сколько копий данных живет при обработке: вход, промежуточный результат, выход шага
+    
+    def __init__(self, memory_limit=256 * 1024 * 1024, num_workers=None, backend=None, max_pixels=DEFAULT_MAX_PIXELS,
+                 spill_dir=None):
+        self.memory_limit = memory_limit #сколько памяти могут занять полосы в работе, байт
+        self.max_pixels = max_pixels #предел размера исходника - по нему же декодируют Consumer и StagedPipeline
+        self.spill_dir = spill_dir #где временные файлы полноразмерных изображений
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.backend = backend #если задан - каждая полоса уходит в пул процессов
+        self.executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="tile")
+        self.cond = threading.Condition()
+        self.in_flight = 0 #полосы в работе или готовые, но еще не вклеенные - общие для всех вызовов apply
+    
+    def should_tile(self, img): #целиком изображение не помещается в лимит
+        return image_nbytes(img) * self.WORKING_COPIES > self.memory_limit
+    
+    def needs_tiling(self, data): #то же по байтам файла: читается только заголовок
+        try:
+            reader = MemoryReader(data)
+            with open_image(reader, self.max_pixels) as img:
+                big = self.should_tile(img)
+            reader.close()
+            return big
+        except Exception:
+            return False #нечитаемый или слишком большой файл - ошибку покажет декодирование
+    
+    def strip_rows(self, img, halo): #высота полосы, при которой полоса с перекрытием помещается в свою долю лимита
+        row_bytes = max(image_nbytes(img) // max(img.height, 1), 1)
+        budget = self.memory_limit // self.num_workers
+        rows = budget // (row_bytes * self.WORKING_COPIES) - 2 * halo
+        return max(rows, 1)
+    
+    def _notify(self, future): #полоса готова - будим того, кто ждет места или готовых полос
+        with self.cond:
+            self.cond.notify_all()
+    
+    #img - декодированное изображение или RawStrips. режим (prepare_for_operations) меняется у каждой полосы
+    #отдельно: копия всего изображения в другом режиме - еще одно полноразмерное изображение в памяти
+    def apply(self, img, operations):
+        halo = operations_halo(operations)
+        rows = self.strip_rows(img, halo)
+        width, height = img.size
+        
+        def process_strip(top):
+            bottom = min(top + rows, height)
+            src_top = max(0, top - halo) #полоса с соседними строками сверху и снизу
+            src_bottom = min(height, bottom + halo)
+            strip = img.crop((0, src_top, width, src_bottom))
+            if self.backend is None:
+                done = apply_operations(strip, operations)
+            else:
+                done = self.backend.transform(strip, operations)
+            return top, done.crop((0, top - src_top, width, bottom - src_top)) #отрезаем перекрытие
+        
+        result = None
+        pending = []
+        
+        def paste_done(): #вклеиваем готовые полосы сразу и освобождаем их место
+            for future in [f for f in pending if f.done()]:
+                pending.remove(future)
+                with self.cond:
+                    self.in_flight -= 1
+                    self.cond.notify_all()
+                top, piece = future.result() #ошибка полосы - ошибка задачи
+                nonlocal result
+                if result is None:
+                    result = SpillImage(piece.mode, (width, height), self.spill_dir)
+                result.paste(piece, top)
+        
+        try:
+            for top in range(0, height, rows):
+                while True:
+                    paste_done()
+                    with self.cond:
+                        if self.in_flight < self.num_workers:
+                            self.in_flight += 1
+                            break
+                        if not any(f.done() for f in pending):
+                            self.cond.wait() #ждем свою готовую полосу или место, освобожденное другими
+                future = self.executor.submit(process_strip, top)
+                pending.append(future)
+                future.add_done_callback(self._notify)
+            while pending:
+                with self.cond:
+                    while not any(f.done() for f in pending):
+                        self.cond.wait()
+                paste_done()
+        finally:
+            if pending: #после ошибки дожидаемся оставшихся полос, чтобы вернуть их место
+                for future in pending:
+                    future.exception()
+                with self.cond:
+                    self.in_flight -= len(pending)
+                    self.cond.notify_all()
+        return result.image
+    
+    #большое изображение из байтов файла: полосами прямо из файла, если формат несжатый, иначе
+    #декодирование во временный файл. результат - изображение во временном файле, кодировать через encode
+    def apply_data(self, data, operations):
+        source = RawStrips.open(data, self.max_pixels)
+        if source is None:
+            source = decode_spilled(data, self.max_pixels, self.spill_dir)
+        return self.apply(source, operations)
+    
+    def encode(self, img, fmt): #сжатый результат - тоже во временный файл
+        return encode_spilled(img, fmt, self.spill_dir)
+    
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+#шаг "transform" для Consumer и StagedPipeline: большие изображения - полосами, остальные - целиком
+def transform_image(img, operations, backend=None, tiler=None):
+    if tiler is not None and tiler.should_tile(img):
+        return tiler.apply(img, operations)
+    if backend is None:
+        return apply_operations(img, operations)
+    return backend.transform(img, operations)
+
+
+#шаги обработки одной задачи - общие для Consumer и StagedPipeline
+
+def read_file(path): #исходник целиком в байты
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size >= MAP_FILE_BYTES:
+            #большой файл (скан) - отображение только для чтения: страницы читает и вытесняет ядро,
+            #а не держит память процесса. отображение закрывается, когда его больше никто не использует
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return f.read()
+
+
+class MemoryReader(io.RawIOBase): #файловый объект поверх bytes/memoryview без копирования всего буфера
+    #io.BytesIO копирует memoryview целиком, а здесь декодер получает только запрошенные куски
+    def __init__(self, data):
+        super().__init__()
+        self.view = memoryview(data)
+        self.pos = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self.pos
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.pos = max(0, offset)
+        return self.pos
+    
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(self.pos + size, len(self.view))
+        chunk = bytes(self.view[self.pos:end])
+        self.pos = max(self.pos, end)
+        return chunk
+    
+    def readinto(self, buffer):
+        chunk = self.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+    
+    def close(self):
+        self.view.release() #иначе отображение архива нельзя будет закрыть
+        super().close()
+
+
+#Image.open, но с пределом max_pixels у этого вызова: Image.open сверяет размер с глобальным
+#Image.MAX_IMAGE_PIXELS, общим для всего процесса. перебор форматов - как в самом Image.open
+def open_image(fp, max_pixels=DEFAULT_MAX_PIXELS):
+    Image.init() #все модули форматов (после первого вызова сразу возвращается)
+    prefix = fp.read(16)
+    for name in Image.ID:
+        factory, accept = Image.OPEN[name]
+        if accept is not None:
+            accepted = accept(prefix)
+            if not accepted or isinstance(accepted, str): #строка - формат узнан, но не поддерживается
+                continue
+        fp.seek(0)
+        try:
+            img = factory(fp, "")
+        except (SyntaxError, IndexError, TypeError, struct.error):
+            continue #не этот формат
+        width, height = img.size
+        if max_pixels is not None and width * height > max_pixels:
+            img.close()
+            raise Image.DecompressionBombError(
+                f"Изображение {width}x{height} ({width * height} пикселей) больше предела {max_pixels}")
+        return img
+    raise Image.UnidentifiedImageError("Неизвестный формат изображения")
+
+
+def decode_image(data, max_pixels=DEFAULT_MAX_PIXELS): #байты (или memoryview архива) -> декодированное изображение
+    reader = MemoryReader(data)
+    img = open_image(reader, max_pixels)
+    img.load() #декодируем сразу, а не лениво при первом обращении
+    reader.close()
+    return img
+
+
+def encode_image(img, fmt): #изображение -> байты в формате fmt
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def write_file(path, data, durable=False):
+    #пишем во временный файл и переименовываем: после сбоя не останется обрезанного результата,
+    #а одновременная запись одного и того же результата из разных потоков не перемешается
+    tmp_path = f"{path}.tmp-{threading.get_ident()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno()) #данные на диске до того, как журнал отметит задачу выполненной
+    os.replace(tmp_path, path)
+    if durable:
+        fsync_dir(os.path.dirname(path) or ".") #и само переименование
+
+
+def fsync_dir(folder): #запись о файле в папке - на диск (на Windows папку открыть нельзя - пропускаем)
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class FileSink: #каждый результат - отдельный файл по task.output_path
+    def write(self, task, data, on_durable=None): #on_durable() вызывается, когда данные записаны на диск
+        write_file(task.output_path, data, durable=on_durable is not None)
+        if on_durable is not None:
+            on_durable()
+    
+    def location(self, task): #где искать результат - для сообщения в TaskResult
+        return task.output_path
+    
+    def close(self):
+        pass
+
+
+class PackSink: #результаты дописываются в большие файлы-сегменты вместо миллионов маленьких файлов
+    #формат: folder/segment-000000.pack - подряд записанные байты результатов,
+    #folder/index.jsonl - строка на результат: ключ, номер задачи, сегмент, смещение, длина.
+    #пишет один поток пачками: сначала данные пачки + fsync сегмента, потом строки индекса + fsync индекса,
+    #поэтому индекс никогда не ссылается на недописанные данные
+    INDEX_NAME = "index.jsonl"
+    
+    def __init__(self, folder, segment_size=1024 * 1024 * 1024, batch_size=64, queue_size=256):
+        self.folder = folder
+        self.segment_size = segment_size #после этого размера начинается новый сегмент
+        self.batch_size = batch_size #сколько результатов максимум за один fsync
+        os.makedirs(folder, exist_ok=True)
+        self.segment_id = self._next_segment_id() #старые сегменты не трогаем - дописываем в новый
+        self.segment = None
+        self.index = open(os.path.join(folder, self.INDEX_NAME), "a", encoding="utf-8")
+        self.queue = BlockingQueue(maxsize=queue_size) #обратное давление, если диск не успевает
+        self.writer = threading.Thread(target=self._write_loop, name="pack-writer")
+        self.writer.start()
+    
+    def _next_segment_id(self):
+        ids = [int(name[8:14]) for name in os.listdir(self.folder)
+               if name.startswith("segment-") and name.endswith(".pack")]
+        return max(ids) + 1 if ids else 0
+    
+    @staticmethod
+    def segment_name(segment_id):
+        return f"segment-{segment_id:06d}.pack"
+    
+    @staticmethod
+    def key(task): #ключ результата в пакете - имя выходного файла
+        return os.path.basename(task.output_path)
+    
+    def submit(self, task, data, on_durable=None): #ставит результат в очередь записи, on_durable - после fsync
+        done = Future() #завершается после fsync пачки или с ошибкой записи
+        self.queue.put((task, data, on_durable, done))
+        return done
+    
+    #ждет fsync пачки: пока ждут несколько потоков, их результаты уходят одной пачкой.
+    #ошибка записи возвращается сюда - задача не будет отмечена сохраненной
+    def write(self, task, data, on_durable=None):
+        self.submit(task, data, on_durable).result()
+    
+    def location(self, task):
+        return f"{self.folder}::{self.key(task)}"
+    
+    def _open_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+        self.segment = open(os.path.join(self.folder, self.segment_name(self.segment_id)), "ab")
+        self.segment_id += 1
+    
+    def _write_loop(self):
+        while True:
+            first = self.queue.get() #ждем хотя бы один результат
+            if first is None: #очередь закрыта и пуста
+                break
+            batch = [first]
+            while len(batch) < self.batch_size: #добираем всё, что уже накопилось, не дожидаясь новых
+                item = self.queue.get(timeout=0)
+                if item is None:
+                    break
+                batch.append(item)
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                logger.exception("[PACK] Ошибка записи пачки из %d результатов", len(batch))
+                for *_, done in batch:
+                    if not done.done():
+                        done.set_exception(e)
+            for _ in batch:
+                self.queue.task_done()
+        
+        if self.segment is not None:
+            self.segment.close()
+        self.index.close()
+    
+    def _write_batch(self, batch):
+        entries = []
+        for task, data, _, _ in batch:
+            if self.segment is None or (self.segment.tell() > 0 and self.segment.tell() + len(data) > self.segment_size):
+                if self.segment is not None:
+                    self.segment.flush()
+                    os.fsync(self.segment.fileno()) #старый сегмент - на диск до перехода к новому
+                self._open_segment()
+            offset = self.segment.tell()
+            self.segment.write(data)
+            entries.append({"key": self.key(task), "task_id": task.task_id,
+                            "segment": self.segment_name(self.segment_id - 1),
+                            "offset": offset, "length": len(data)})
+        self.segment.flush()
+        os.fsync(self.segment.fileno()) #данные пачки на диске
+        
+        self.index.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+        self.index.flush()
+        os.fsync(self.index.fileno()) #индекс - только после данных
+        
+        for _, _, on_durable, done in batch:
+            try:
+                if on_durable is not None:
+                    on_durable()
+                done.set_result(None)
+            except Exception as e: #данные на диске, но отметка (журнал) не удалась - задача повторится
+                done.set_exception(e)
+    
+    def close(self): #дописывает очередь и закрывает файлы
+        self.queue.close()
+        self.writer.join()
+
+
+class PackReader: #чтение отдельных результатов из пакета PackSink по ключу или номеру задачи
+    def __init__(self, folder):
+        self.folder = folder
+        self.by_key = {}
+        self.by_task_id = {}
+        with open(os.path.join(folder, PackSink.INDEX_NAME), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue #оборванная последняя строка после сбоя
+                self.by_key[entry["key"]] = entry #при повторной записи побеждает последняя
+                self.by_task_id[entry["task_id"]] = entry
+    
+    def keys(self):
+        return list(self.by_key)
+    
+    def get(self, key=None, task_id=None): #байты результата или KeyError
+        entry = self.by_key[key] if key is not None else self.by_task_id[task_id]
+        with open(os.path.join(self.folder, entry["segment"]), "rb") as f:
+            f.seek(entry["offset"])
+            return f.read(entry["length"])
+
+
+class CompletionJournal: #журнал выполненных задач: повторный запуск пропускает то, что уже сделано
+    #строка на результат, который уже на диске (записывается из on_durable приемника): выходной путь,
+    #исходник, его размер, mtime и хэш. запись - дописывание строки + fsync, поэтому сбой теряет
+    #самое большее последнюю оборванную строку, которая при чтении пропускается
+    def __init__(self, path):
+        self.path = path
+        self.entries = {} #выходной путь -> последняя запись
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue #оборванная последняя строка после сбоя
+                    self.entries[entry["output"]] = entry
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock() #порядок строк в файле
+        self.sync_lock = threading.Lock() #один fsync на всех, кто успел дописать строку (групповая фиксация)
+        self.written = 0 #сколько строк дописано
+        self.synced = 0 #сколько из них уже на диске
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    #выполнена ли задача: размер и mtime исходника те же, что в журнале. если mtime изменился, а размер нет -
+    #сравниваем хэш содержимого (read_digest() -> sha256), файл могли просто перезаписать тем же
+    def is_done(self, output_path, stat, read_digest):
+        entry = self.entries.get(output_path)
+        if entry is None or stat is None or entry["size"] != stat[0]:
+            return False
+        if entry["mtime"] != stat[1]:
+            if read_digest() != entry["digest"]:
+                return False
+            self._append(dict(entry, mtime=stat[1])) #следующий запуск обойдется без чтения файла
+        return True
+    
+    def record(self, task, digest): #вызывается после того, как результат task надежно записан
+        size, mtime = task.input_stat or (None, None)
+        self._append({"output": task.output_path, "input": task.input_path, "source": task.source,
+                      "size": size, "mtime": mtime, "digest": digest, "task_id": task.task_id,
+                      "time": time.time()})
+    
+    def _append(self, entry):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.entries[entry["output"]] = entry
+            self.file.write(line)
+            self.file.flush()
+            self.written += 1
+            position = self.written
+        with self.sync_lock:
+            if self.synced < position: #иначе нашу строку уже сбросил на диск чужой fsync
+                with self.lock:
+                    target = self.written
+                os.fsync(self.file.fileno())
+                self.synced = target
+    
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def journal_callback(journal, task, digest): #on_durable для приемника: отметить задачу в журнале
+    if journal is None:
+        return None
+    return lambda: journal.record(task, digest)
+
+
+@contextmanager
+def stage_timer(times, stage): #добавляет время блока with в словарь times под именем этапа
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        times[stage] = times.get(stage, 0.0) + time.perf_counter() - start
+
+
+#формат для сохранения по расширению выходного файла: ".png" -> "PNG"
+def output_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    fmt = Image.registered_extensions().get(ext)
+    if fmt is None:
+        raise ValueError(f"Неизвестный формат файла: {path}")
+    return fmt
+
+
+class _InFlight: #вычисление, которое уже идет в другом потоке
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class LRUCache: #потокобезопасный кэш с ограничением по объему в байтах, при переполнении вытесняет давно не использованное
+    def __init__(self, max_bytes, sizeof=len): #sizeof - функция, считающая размер значения в байтах
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.items = OrderedDict() #ключ -> (значение, размер), в конце - самые свежие
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.inflight = {} #ключ -> _InFlight, чтобы одно и то же значение не считалось дважды
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key) #отмечаем как недавно использованный
+            self.hits += 1
+            return entry[0]
+    
+    #возвращает (значение, было ли попадание). compute вызывается не больше одного раза на ключ одновременно,
+    #остальные потоки с тем же ключом ждут его результат
+    def get_or_compute(self, key, compute):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is not None:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return entry[0], True
+            waiting = self.inflight.get(key)
+            leader = waiting is None
+            if leader:
+                waiting = self.inflight[key] = _InFlight() #этот поток будет считать
+                self.misses += 1
+            else:
+                self.hits += 1
+        
+        if not leader: #кто-то уже считает этот ключ - ждем его результат
+            waiting.done.wait()
+            if waiting.error is not None:
+                raise waiting.error
+            return waiting.value, True
+        
+        try:
+            waiting.value = compute()
+            self.put(key, waiting.value)
+            return waiting.value, False
+        except Exception as e:
+            waiting.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            waiting.done.set() #будим ожидающие потоки
+    
+    @property
+    def hit_rate(self): #доля попаданий
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+    
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return #слишком большое значение не кэшируем, чтобы не вытеснить всё остальное
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self.items[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes: #вытесняем самые старые
+                _, (_, old_size) = self.items.popitem(last=False)
+                self.current_bytes -= old_size
+    
+    def __len__(self):
+        return len(self.items)
+
+
+class ResultCache: #кэш готовых (закодированных) результатов: в памяти (LRU) и на диске
+    def __init__(self, max_memory_bytes=64 * 1024 * 1024, cache_dir=None):
+        self.memory = LRUCache(max_memory_bytes)
+        self.cache_dir = cache_dir #None - только память
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+    
+    #ключ = хэш содержимого исходника + цепочка операций с параметрами + формат результата
+    @staticmethod
+    def make_key(source_digest, operations, fmt):
+        digest = hashlib.sha256(source_digest.encode())
+        for op in operations:
+            digest.update(op.type.value.encode())
+            digest.update(repr(sorted(op.params.items())).encode())
+        digest.update(fmt.encode())
+        return digest.hexdigest()
+    
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key) #подпапки по первым символам, чтобы не держать всё в одной папке
+    
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
             return None
     
+    def _write_disk(self, key, data):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path) #атомарная замена - другой поток не увидит недописанный файл
+    
+    def get(self, key):
+        data = self.memory.get(key)
+        if data is None:
+            data = self._read_disk(key)
+            if data is not None:
+                self.memory.put(key, data) #поднимаем в память
+        return data
+    
+    def put(self, key, data):
+        self.memory.put(key, data)
+        self._write_disk(key, data)
+    
+    #возвращает (данные, было ли попадание). одинаковые ключи от разных потребителей считаются один раз
+    def get_or_compute(self, key, compute):
+        from_disk = []
+        
+        def load(): #выполняется только в одном потоке на ключ
+            data = self._read_disk(key) #может быть на диске с прошлого запуска
+            if data is None:
+                data = compute()
+                self._write_disk(key, data)
+            else:
+                from_disk.append(True)
+            return data
+        
+        data, hit = self.memory.get_or_compute(key, load)
+        hit = hit or bool(from_disk)
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return data, hit
+
+
+#сколько байт занимает декодированное изображение в памяти PIL
+def image_nbytes(img):
+    if img.mode.startswith("I;16"):
+        pixel = 2
+    elif len(img.getbands()) > 1 or img.mode in ("I", "F"):
+        pixel = 4 #многоканальные пиксели PIL хранит по 4 байта (RGB как RGBX)
+    else:
+        pixel = 1
+    return img.width * img.height * pixel
+
+
+class DecodedImageCache: #общий для всех потребителей кэш декодированных изображений: популярный исходник декодируется один раз
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.cache = LRUCache(max_bytes, sizeof=image_nbytes)
+    
+    #key - хэш содержимого файла, data - его байты. возвращает (изображение, было ли попадание).
+    #изображение общее для нескольких потоков: его можно только читать (все эффекты создают новое изображение)
+    def get_or_decode(self, key, data, max_pixels=DEFAULT_MAX_PIXELS):
+        return self.cache.get_or_compute(key, lambda: decode_image(data, max_pixels))
+    
+    @property
+    def hit_rate(self):
+        return self.cache.hit_rate
+    
+    @property
+    def resident_bytes(self): #сколько памяти сейчас занимают изображения в кэше
+        return self.cache.current_bytes
+
+
+class BlockingQueue: #потокобезопасная FIFO-очередь с ограничением размера и закрытием (конец потока данных)
+    #все ожидания - на условных переменных: потоки спят, пока нет события, а не опрашивают очередь по таймауту
+    def __init__(self, maxsize=0): #maxsize=0 - без ограничения
+        self.maxsize = maxsize
+        self.items = deque()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock) #будит get, когда появился элемент или очередь закрыли
+        self.not_full = threading.Condition(self.lock) #будит put, когда освободилось место (обратное давление)
+        self.all_done = threading.Condition(self.lock) #будит join, когда все задачи отмечены task_done
+        self.unfinished = 0 #взятые или ждущие элементы без task_done
+        self.retire_requests = 0 #сколько читателей должны получить None и завершиться (уменьшение пула)
+        self.active = True #после close() новые элементы не принимаются, оставшиеся можно дочитать
+    
+    def _put_item(self, item): #как хранить элемент - переопределяется в наследниках
+        self.items.append(item)
+    
+    def _get_item(self): #какой элемент выдать следующим
+        return self.items.popleft()
+    
+    def put(self, item): #блокируется, пока в очереди нет места
+        with self.not_full:
+            while self.active and self.maxsize > 0 and len(self.items) >= self.maxsize:
+                self.not_full.wait()
+            if not self.active:
+                raise Exception("Очередь закрыта")
+            self._put_item(item)
+            self.unfinished += 1
+            size = len(self.items)
+            self.not_empty.notify() #будим один ожидающий get
+        logger.debug("[Queue] + Добавлен элемент. Очередь: %d", size)
+     
+    #блокируется до появления элемента. возвращает None, когда очередь закрыта и пуста
+    #или читателя попросили завершиться (retire_one) - это сигнал конца работы.
+    #timeout - необязательное ограничение ожидания
+    def get(self, timeout=None):
+        with self.not_empty:
+            while True:
+                if self.retire_requests > 0:
+                    self.retire_requests -= 1
+                    return None
+                if self.items:
+                    break
+                if not self.active:
+                    return None
+                if not self.not_empty.wait(timeout):
+                    return None
+            item = self._get_item()
+            size = len(self.items)
+            self.not_full.notify() #место освободилось
+        logger.debug("[Queue] - Извлечен элемент. Очередь: %d", size)
+        return item
+    
     def task_done(self): #для отметки о выполнении задачи 
-        self.queue.task_done() #вызов метода внутренней очереди - сообщает, что обработки задачи завершена 
+        with self.lock:
+            self.unfinished -= 1
+            if self.unfinished <= 0:
+                self.all_done.notify_all()
     
-    def close(self):
-        self.active = False #установка флага активности в False - после этого вызов put() будет выбрасывать исключение. существующие элементы можно всё еще можно получить
+    def join(self): #ждет, пока все положенные элементы будут обработаны
+        with self.all_done:
+            while self.unfinished > 0:
+                self.all_done.wait()
+    
+    def retire_one(self): #следующий вызов get (у любого читателя) вернет None - читатель завершится после текущей задачи
+        with self.lock:
+            self.retire_requests += 1
+            self.not_empty.notify() #будим один простаивающий get
+    
+    def close(self): #конец потока данных: put больше нельзя, get дочитывает остаток и затем возвращает None
+        with self.lock:
+            self.active = False
+            self.not_empty.notify_all() #будим всех ожидающих, чтобы они увидели закрытие
+            self.not_full.notify_all()
     
     def size(self):
-        return self.queue.qsize() 
+        with self.lock:
+            return len(self.items)
+
+
+#относительная стоимость операций на мегапиксель: размытие - несколько проходов по изображению,
+#поточечные операции сливаются в одну таблицу, отражение - только перестановка строк
+OPERATION_COST = {
+    ProcessingType.INVERT: 1.0,
+    ProcessingType.GAMMA: 1.0,
+    ProcessingType.LUT: 1.0,
+    ProcessingType.MIRROR: 0.5,
+    ProcessingType.BLUR: 4.0,
+}
+
+
+def image_pixels(task): #число пикселей по заголовку исходника - без декодирования
+    try:
+        #только заголовок, предел размера не нужен: оценка не декодирует (большой файл отклонит потребитель)
+        if task.source is None:
+            with open(task.input_path, "rb") as f, open_image(f, None) as img:
+                width, height = img.size
+        else:
+            reader = MemoryReader(read_input(task)) #для архива - срез отображения, без копирования
+            with open_image(reader, None) as img:
+                width, height = img.size
+            reader.close()
+    except Exception:
+        return 0 #нечитаемый исходник быстро завершится ошибкой - считаем его дешевым
+    return width * height
+
+
+def estimate_cost(task): #оценка работы: мегапиксели * сумма стоимостей операций цепочки
+    return image_pixels(task) / 1e6 * (1.0 + sum(OPERATION_COST.get(op.type, 1.0) for op in task.operations))
+
+
+def priority_key(task): #сначала больший приоритет, при равном - раньший срок
+    return (-task.priority, task.deadline if task.deadline is not None else math.inf)
+
+
+class CostPolicy: #приоритет + "виртуальный срок": время постановки + оценка стоимости * aging
+    #при равном приоритете мелкие задачи обгоняют крупные, но крупная ждет не дольше своей стоимости * aging
+    #секунд после постановки - не голодает. явный deadline задачи, если он раньше, важнее виртуального
+    def __init__(self, aging=1.0, estimator=estimate_cost):
+        self.aging = aging #секунд ожидания на единицу стоимости (мегапиксель-операцию)
+        self.estimator = estimator
+    
+    def __call__(self, task):
+        virtual = time.time() + self.estimator(task) * self.aging
+        if task.deadline is not None:
+            virtual = min(virtual, task.deadline)
+        return (-task.priority, virtual)
+
+
+class PriorityBlockingQueue(BlockingQueue): #BlockingQueue с выдачей по ключу вместо FIFO (куча)
+    def __init__(self, maxsize=0, key=priority_key):
+        super().__init__(maxsize)
+        self.items = [] #куча (ключ, номер постановки, элемент)
+        self.key = key #key(task) -> ключ сортировки, меньше - раньше
+        self.order = itertools.count() #при равных ключах - в порядке постановки
+    
+    def put(self, item):
+        #ключ считается до захвата блокировки: оценка стоимости читает заголовок файла
+        super().put((self.key(item), next(self.order), item))
+    
+    def _put_item(self, entry):
+        heapq.heappush(self.items, entry)
+    
+    def _get_item(self):
+        return heapq.heappop(self.items)[2]
+
+
+def make_task_queue(scheduling, maxsize=0): #очередь задач для выбранного порядка выдачи
+    if scheduling == SchedulingMode.PRIORITY:
+        return PriorityBlockingQueue(maxsize, priority_key)
+    if scheduling == SchedulingMode.COST:
+        return PriorityBlockingQueue(maxsize, CostPolicy())
+    return BlockingQueue(maxsize)
+
+
+class DirectoryScanner: #ленивый рекурсивный обход папки через os.scandir, общий для нескольких производителей
+    #папки раздаются производителям по мере обнаружения: каждый берет следующую непрочитанную папку,
+    #поэтому задачи появляются сразу, без полного списка файлов, а большое дерево читается параллельно.
+    #если непрочитанных папок нет, производитель присоединяется к уже открытой: записи одной папки
+    #раздаются порциями по chunk_size из общего итератора scandir - плоскую папку с миллионами
+    #файлов разбирают все производители, а не один
+    def __init__(self, root, recursive=True, extensions=IMAGE_EXTENSIONS, chunk_size=256):
+        self.root = root
+        self.recursive = recursive
+        self.extensions = extensions
+        self.chunk_size = chunk_size
+        self.pending = [root] #папки, которые еще никто не начал читать
+        self.listings = [] #открытые папки: [итератор scandir, блокировка] - их дочитывают все желающие
+        self.turn = 0 #к какой открытой папке присоединится следующий производитель (по кругу)
+        self.lock = threading.Lock()
+    
+    #папка для чтения: новая из pending или одна из уже открытых. None - обход закончен:
+    #подпапки добавляются в pending при чтении порции, поэтому пока открыта хоть одна папка, работа есть
+    def _next_listing(self):
+        with self.lock:
+            while self.pending:
+                folder = self.pending.pop()
+                try:
+                    listing = [os.scandir(folder), threading.Lock()]
+                except OSError:
+                    if folder == self.root:
+                        raise #нет корневой папки - это ошибка, пропавшую подпапку просто пропускаем
+                    continue
+                self.listings.append(listing)
+                return listing
+            if not self.listings:
+                return None
+            self.turn += 1
+            return self.listings[self.turn % len(self.listings)]
+    
+    #следующие chunk_size записей папки -> (пути к изображениям, дочитана ли папка).
+    #подпапки сразу уходят в pending - их могут начать читать другие производители
+    def _read_chunk(self, listing):
+        paths = []
+        with listing[1]:
+            entries = listing[0]
+            if entries is None: #дочитал другой производитель
+                return paths, True
+            count = 0
+            for entry in itertools.islice(entries, self.chunk_size):
+                count += 1
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue #запись пропала во время обхода
+                if is_dir:
+                    if self.recursive:
+                        with self.lock:
+                            self.pending.append(entry.path)
+                elif entry.name.lower().endswith(self.extensions): #проверяет расширение в нижнем регистре
+                    paths.append(entry.path)
+            finished = count < self.chunk_size
+            if finished:
+                entries.close()
+                listing[0] = None
+                with self.lock:
+                    self.listings.remove(listing)
+        return paths, finished
+    
+    #генератор путей к изображениям. каждый производитель вызывает свой, а папки и порции делятся между ними
+    def iter_shard(self):
+        while True:
+            listing = self._next_listing()
+            if listing is None:
+                return
+            finished = False
+            while not finished:
+                paths, finished = self._read_chunk(listing)
+                yield from paths
+
+
+class DirectorySource: #исходники - отдельные файлы в папке (и подпапках)
+    spec = None #задачам не нужен источник: input_path - обычный путь на диске
+    
+    def __init__(self, root):
+        self.root = root
+    
+    def scanner(self): #общий для всех производителей обход
+        return DirectoryScanner(self.root)
+    
+    def read(self, name):
+        return read_file(name)
+    
+    def stat(self, name): #(размер, mtime в нс) - по ним журнал понимает, что исходник не менялся
+        st = os.stat(name)
+        return st.st_size, st.st_mtime_ns
+    
+    def display_name(self, name): #путь относительно корня - для имени выходного файла
+        return os.path.relpath(name, self.root)
+    
+    def close(self):
+        pass
+
+
+class SharedIterator: #готовый список имен, который несколько производителей разбирают без повторов
+    def __init__(self, names):
+        self.names = iter(names)
+        self.lock = threading.Lock()
+    
+    def iter_shard(self):
+        while True:
+            with self.lock:
+                name = next(self.names, None)
+            if name is None:
+                return
+            yield name
+
+
+class MappedSource: #общая часть архивов: файл отображен в память, чтение - срез memoryview без системных вызовов
+    def __init__(self, spec, path):
+        self.spec = spec
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        self.mtime = os.fstat(self.file.fileno()).st_mtime_ns #у файлов внутри архива - время самого архива
+        self.entries = {} #имя -> (смещение, длина) для файлов, которые можно читать прямо из отображения
+    
+    def names(self):
+        return [name for name in self.entries if name.lower().endswith(IMAGE_EXTENSIONS)]
+    
+    def scanner(self):
+        return SharedIterator(self.names())
+    
+    def read(self, name): #memoryview - без копирования, декодер читает прямо из страниц отображения
+        offset, length = self.entries[name]
+        return self.view[offset:offset + length]
+    
+    def stat(self, name):
+        return self.entries[name][1], self.mtime
+    
+    def display_name(self, name):
+        return name
+    
+    def close(self):
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            #срез еще держит задача или кэш - отображение закроется сборщиком мусора вместе с ним
+            logger.warning("[SOURCE] %s: отображение еще используется", self.path)
+        self.file.close()
+
+
+class TarSource(MappedSource): #tar-архив. без сжатия файлы лежат в архиве целиком - читаются срезами отображения
+    def __init__(self, spec, path):
+        super().__init__(spec, path)
+        try:
+            self.archive = tarfile.open(path, "r:") #открывается только архив без сжатия
+            compressed = False
+        except tarfile.ReadError:
+            self.archive = tarfile.open(path, "r:*")
+            compressed = True
+        self.lock = threading.Lock() #извлечение из сжатого архива - общий поток распаковки
+        self.packed = {} #файлы, которые приходится распаковывать
+        for member in self.archive.getmembers():
+            if not member.isfile():
+                continue
+            if compressed or member.issparse():
+                self.packed[member.name] = member
+            else:
+                self.entries[member.name] = (member.offset_data, member.size)
+    
+    def names(self):
+        return super().names() + [name for name in self.packed if name.lower().endswith(IMAGE_EXTENSIONS)]
+    
+    def read(self, name):
+        if name in self.packed:
+            with self.lock:
+                return self.archive.extractfile(self.packed[name]).read()
+        return super().read(name)
+    
+    def stat(self, name):
+        if name in self.packed:
+            return self.packed[name].size, self.mtime
+        return super().stat(name)
+    
+    def close(self):
+        self.archive.close()
+        super().close()
+
+
+class ZipSource(MappedSource): #zip-архив. несжатые (ZIP_STORED) файлы читаются срезами отображения
+    def __init__(self, spec, path):
+        super().__init__(spec, path)
+        self.archive = zipfile.ZipFile(path)
+        self.packed = {} #сжатые или зашифрованные - через zipfile
+        for info in self.archive.infolist():
+            if info.is_dir():
+                continue
+            if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+                self.packed[info.filename] = info
+                continue
+            #данные начинаются после локального заголовка: 30 байт + имя + дополнительное поле
+            header = info.header_offset
+            name_length, extra_length = struct.unpack("<HH", self.map[header + 26:header + 30])
+            self.entries[info.filename] = (header + 30 + name_length + extra_length, info.file_size)
+    
+    def names(self):
+        return super().names() + [name for name in self.packed if name.lower().endswith(IMAGE_EXTENSIONS)]
+    
+    def read(self, name):
+        if name in self.packed:
+            return self.archive.read(name) #ZipFile сам блокирует общий файл
+        return super().read(name)
+    
+    def stat(self, name):
+        if name in self.packed:
+            return self.packed[name].file_size, self.mtime
+        return super().stat(name)
+    
+    def close(self):
+        self.archive.close()
+        super().close()
+
+
+class PackSource: #пакет в формате PackSink: индекс + сегменты, каждый сегмент отображен в память
+    def __init__(self, spec, folder):
+        self.spec = spec
+        self.folder = folder
+        self.index = PackReader(folder).by_key
+        self.lock = threading.Lock()
+        self.files = {} #сегмент -> (файл, отображение, memoryview), отображаются при первом обращении
+        self.mtimes = {}
+    
+    def scanner(self):
+        return SharedIterator([key for key in self.index if key.lower().endswith(IMAGE_EXTENSIONS)])
+    
+    def _segment_view(self, segment):
+        with self.lock:
+            if segment not in self.files:
+                f = open(os.path.join(self.folder, segment), "rb")
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.files[segment] = (f, mapped, memoryview(mapped))
+            return self.files[segment][2]
+    
+    def read(self, name):
+        entry = self.index[name]
+        return self._segment_view(entry["segment"])[entry["offset"]:entry["offset"] + entry["length"]]
+    
+    def stat(self, name): #mtime сегмента: дописанные сегменты не меняются, поэтому время стабильно
+        entry = self.index[name]
+        with self.lock:
+            if entry["segment"] not in self.mtimes:
+                self.mtimes[entry["segment"]] = os.stat(os.path.join(self.folder, entry["segment"])).st_mtime_ns
+            return entry["length"], self.mtimes[entry["segment"]]
+    
+    def display_name(self, name):
+        return name
+    
+    def close(self):
+        with self.lock:
+            for f, mapped, view in self.files.values():
+                view.release()
+                try:
+                    mapped.close()
+                except BufferError:
+                    logger.warning("[SOURCE] %s: отображение еще используется", self.folder)
+                f.close()
+            self.files.clear()
+
+
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+_sources = {} #открытые архивы по описанию - один на процесс, общий для всех потоков
+_sources_lock = threading.Lock()
+
+
+#источник исходников по описанию: папка, пакет PackSink (папка с index.jsonl), tar или zip.
+#тип можно указать явно префиксом dir:, pack:, tar:, zip:
+def open_source(spec):
+    kind, _, path = spec.partition(":")
+    if kind not in ("dir", "pack", "tar", "zip") or not path:
+        kind, path = None, spec
+    if kind is None:
+        if os.path.isdir(path):
+            kind = "pack" if os.path.exists(os.path.join(path, PackSink.INDEX_NAME)) else "dir"
+        elif path.lower().endswith(TAR_EXTENSIONS):
+            kind = "tar"
+        elif path.lower().endswith(".zip"):
+            kind = "zip"
+        else:
+            kind = "dir" #не существующая папка - ошибку сообщит обход
+    if kind == "dir":
+        return DirectorySource(path)
+    with _sources_lock:
+        if spec not in _sources:
+            classes = {"pack": PackSource, "tar": TarSource, "zip": ZipSource}
+            _sources[spec] = classes[kind](spec, path)
+        return _sources[spec]
+
+
+def close_sources():
+    with _sources_lock:
+        for source in _sources.values():
+            source.close()
+        _sources.clear()
+
+
+def read_input(task): #байты исходника задачи: файл с диска или срез отображенного архива
+    if task.source is None:
+        return read_file(task.input_path)
+    return open_source(task.source).read(task.input_path)
+
+
+#упаковка папки исходников в пакет PackSink - один большой файл вместо множества мелких для переноса на узел обработки.
+#ключ - путь относительно корня с "_" вместо разделителей (как в именах выходных файлов)
+def build_pack(input_folder, pack_folder, segment_size=1024 * 1024 * 1024):
+    sink = PackSink(pack_folder, segment_size=segment_size)
+    pending = [] #не ждем fsync каждого файла - иначе один поток пишет по файлу на пачку
+    try:
+        for task_id, path in enumerate(DirectoryScanner(input_folder).iter_shard()):
+            key = os.path.relpath(path, input_folder).replace(os.sep, "_")
+            #задача только переносит байты: тип обработки в пакете не используется
+            task = ImageTask(task_id, path, key, ProcessingType.INVERT, time.time())
+            pending.append(sink.submit(task, read_file(path)))
+    finally:
+        sink.close()
+    for done in pending: #ошибка записи любой пачки - пакет неполный
+        done.result()
+    return len(pending)
 
 
 class Producer(threading.Thread): #создается класс Producer, который наследуется от threading.Thread, значит, каждый объект Producer будет работать в отдельном потоке 
     
     def __init__(self, task_queue, images_folder, output_folder, 
-                 process_type, num_images):
+                 operations, num_images, mode=ProducerMode.RANDOM, scanner=None,
+                 task_ids=None, producer_id=1, source=None, journal=None, priority=0, deadline=None):
         super().__init__() #вызов конструктора родительского класса 
         self.task_queue = task_queue #запоминается ссылка на очередь задач в атрибуте объекта
         self.images_folder = images_folder #сохранение папки с исходниками
         self.output_folder = output_folder #сохранение папки для результатов 
-        self.process_type = process_type #сохранение типа обработки
-        self.num_images = num_images #количество изображений для обработки
+        self.operations = normalize_operations(operations) #сохранение цепочки обработки (один тип или несколько по порядку)
+        self.num_images = num_images #количество изображений для обработки (в режиме ALL - ограничение, None - все файлы)
+        self.mode = mode #случайная выборка или каждый файл один раз
+        self.source = source or DirectorySource(images_folder) #откуда берутся исходники: папка, архив или пакет
+        self.scanner = scanner or self.source.scanner() #общий обход папок, если производителей несколько
+        self.task_ids = task_ids or itertools.count() #общий счетчик номеров задач - next() у itertools.count атомарен
+        self.producer_id = producer_id
+        self.journal = journal #CompletionJournal - уже выполненные задачи не ставятся в очередь (только режим ALL)
+        self.priority = priority #приоритет всех задач производителя
+        self.deadline = deadline #срок на задачу в секундах от ее создания, None - без срока
         self.running = True #флаг работы
         self.tasks_created = 0 #счетчик созданных задач
+        self.tasks_skipped = 0 #сколько исходников пропущено: результат уже есть в журнале
+        self.error = None #исключение обхода источника - run_batch поднимет его после завершения запуска
         
         os.makedirs(output_folder, exist_ok=True) #создание всех папок по пути если их нет, exist_ok=True - не выдаёт ошибку, если папка уже существует
-        print("[PRODUCER] Создан") #отладочный вывод - сообщает о создании производителя
+        logger.info("[PRODUCER-%d] Создан", producer_id) #отладочный вывод - сообщает о создании производителя
     
     def run(self): #метод run() - переопределяет метод родительского класса Thread, когда вызывается start(), этот код выполняется в новом потоке. 
-        print("\n[PRODUCER] НАЧАЛО РАБОТЫ")
+        logger.info("[PRODUCER-%d] НАЧАЛО РАБОТЫ", self.producer_id)
         
-        #получаем список изображений
         try:
-            all_images = [f for f in os.listdir(self.images_folder) #перебирает каждый файл из списка всех файлов в папке
-                         if f.lower().endswith(('.png', '.jpg', '.jpeg'))] #проверяет расширение
-                         #переводит имя файла в нижний регистр
-        except FileNotFoundError:
-            print("[PRODUCER] ОШИБКА: Папка не найдена!")
+            for input_path in self.iter_inputs():
+                if not self.running: #если self.running стал False 
+                    break #выходим из цикла
+                output_path = self.output_path(input_path)
+                stat = self.input_stat(input_path)
+                if self.is_done(input_path, output_path, stat):
+                    self.tasks_skipped += 1 #номер задачи не тратим - num_images ограничивает только новую работу
+                    continue
+                task_id = next(self.task_ids)
+                if self.num_images is not None and task_id >= self.num_images:
+                    break
+                self.task_queue.put(self.make_task(task_id, input_path, output_path, stat)) # отправка в очередь -> помещает созданную задачу в общую очередь
+                self.tasks_created += 1
+        except Exception as e: #нет папки, нет доступа, битый архив: иначе запуск молча кончился бы без задач
+            logger.error("[PRODUCER-%d] ОШИБКА: %s: %s", self.producer_id, self.images_folder, e)
+            self.error = e
             return
         
-        if not all_images: #если изображений не найдено 
-            print("[PRODUCER] Нет изображений!")
+        logger.info("[PRODUCER-%d] ЗАВЕРШЕНИЕ: создано %d задач, пропущено выполненных %d",
+                    self.producer_id, self.tasks_created, self.tasks_skipped)
+    
+    #пути к исходникам в порядке обработки. в режиме ALL - поток по мере обхода папок, без задержек
+    def iter_inputs(self):
+        if self.mode == ProducerMode.ALL:
+            yield from self.scanner.iter_shard()
             return
         
-        print(f"[PRODUCER] Найдено изображений: {len(all_images)}") #сообщает сколько изображений найдено в папке 
-        
-        #создаем задачи
-        for i in range(self.num_images):
-            if not self.running: #если self.running стал False 
-                break #выходим из цикла
-            
-            #выбираем случайное изображение
-            image_file = random.choice(all_images)
-            input_path = os.path.join(self.images_folder, image_file) #формирование полного пути к исходному файлу 
-            #         соединяет части пути/папка с исходниками/имя выбранного файла
-            
-            #имя выходного файла
-            name, ext = os.path.splitext(image_file) #разбиение имени файла на 2 части - имя файла без расширения/расширение с точкой
-            timestamp = datetime.now().strftime("%H%M%S") #создание временной метки
-            output_name = f"{name}_{self.process_type.value}_{i}_{timestamp}{ext}" #формирование имени выходного файла
-            #            имя файла/     тип обработки    /номер задачи/дата создания/расширение
-            output_path = os.path.join(self.output_folder, output_name) #полный путь к выходному файлу 
-            
-            #создаем задачу
-            task = ImageTask(
-                task_id=i,
-                input_path=input_path,
-                output_path=output_path,
-                process_type=self.process_type,
-                created_time=time.time()
-            )
-            
-            #отправляем в очередь
-            print(f"[PRODUCER] Задача #{i}: {image_file}")
-            self.task_queue.put(task) # отправка в очередь -> помещает созданную задачу в общую очередь
-            self.tasks_created += 1
-            
-            #небольшая задержка
-            time.sleep(0.3)
-        
-        print(f"[PRODUCER] ЗАВЕРШЕНИЕ: создано {self.tasks_created} задач")
+        #для случайной выборки нужен полный список
+        all_images = list(self.scanner.iter_shard())
+        if not all_images: #если изображений не найдено 
+            logger.warning("[PRODUCER-%d] Нет изображений!", self.producer_id)
+            return
+        logger.info("[PRODUCER-%d] Найдено изображений: %d", self.producer_id, len(all_images)) #сообщает сколько изображений найдено в папке 
+        while True:
+            yield random.choice(all_images) #выбираем случайное изображение, количество ограничивает num_images
+    
+    #выходной путь зависит только от исходника и цепочки - повторный запуск получает те же имена
+    def output_path(self, input_path):
+        #имя выходного файла: путь относительно корня, чтобы одинаковые имена из разных подпапок не совпали
+        relative = self.source.display_name(input_path)
+        name, ext = os.path.splitext(relative.replace(os.sep, "_").replace("/", "_")) #разбиение имени файла на 2 части - имя файла без расширения/расширение с точкой
+        output_name = f"{name}_{operations_label(self.operations)}_{operations_id(self.operations)}{ext}" #формирование имени выходного файла
+        #            имя файла/     цепочка обработки            /   хэш цепочки с параметрами  /расширение
+        return os.path.join(self.output_folder, output_name) #полный путь к выходному файлу 
+    
+    def input_stat(self, input_path): #размер и mtime исходника - нужны только журналу
+        if self.journal is None:
+            return None
+        try:
+            return self.source.stat(input_path)
+        except OSError:
+            return None #файл пропал после обхода - ошибку сообщит потребитель
+    
+    def is_done(self, input_path, output_path, stat):
+        #в случайном режиме одно изображение выбирается много раз - пропуск зациклил бы производителя
+        if self.journal is None or self.mode != ProducerMode.ALL:
+            return False
+        try:
+            return self.journal.is_done(output_path, stat,
+                                        lambda: hashlib.sha256(self.source.read(input_path)).hexdigest())
+        except OSError:
+            return False
+    
+    def make_task(self, task_id, input_path, output_path=None, stat=None):
+        output_path = output_path or self.output_path(input_path)
+        logger.debug("[PRODUCER-%d] Задача #%d: %s", self.producer_id, task_id, input_path)
+        created_time = time.time()
+        return ImageTask(
+            task_id=task_id,
+            input_path=input_path,
+            output_path=output_path,
+            process_type=self.operations[0].type,
+            created_time=created_time,
+            operations=self.operations,
+            source=self.source.spec,
+            input_stat=list(stat) if stat is not None else None,
+            priority=self.priority,
+            deadline=created_time + self.deadline if self.deadline is not None else None
+        )
     
     def stop(self):
         self.running = False
 
 
 class Consumer(threading.Thread):  #создает класс Consumer, каждый будет работать в отдельном потоке и обрабатывать изображения
-    def __init__(self, consumer_id, task_queue, result_queue):
+    def __init__(self, consumer_id, task_queue, result_queue, backend=None, result_cache=None,
+                 image_cache=None, tiler=None, metrics=None, sink=None, journal=None):
         super().__init__()
         self.consumer_id = consumer_id
         self.task_queue = task_queue #очередь задач - откуда брать изображения на обработку
         self.result_queue = result_queue #очередь результатов 
-        self.running = True
+        self.backend = backend #None - обработка в этом же потоке, ProcessBackend - в пуле процессов
+        self.result_cache = result_cache #общий для всех потребителей ResultCache или None
+        self.image_cache = image_cache #общий DecodedImageCache или None
+        self.tiler = tiler #общий TiledProcessor для больших изображений или None
+        self.max_pixels = tiler.max_pixels if tiler is not None else DEFAULT_MAX_PIXELS #предел размера исходника
+        self.metrics = metrics #общий Metrics - учет занятости потока
+        self.sink = sink or FileSink() #куда сохранять результаты: отдельные файлы или пакет
+        self.journal = journal #CompletionJournal - отметка о выполнении, когда результат на диске
         self.processed_count = 0
-        print(f"[Consumer-{consumer_id}] Создан")
+        self.busy_time = 0.0 #сколько секунд поток был занят обработкой - по нему ConsumerPool решает о масштабировании
+        logger.info("[Consumer-%d] Создан", consumer_id)
     
     def run(self):
-        print(f"\n[Consumer-{self.consumer_id}] НАЧАЛО РАБОТЫ")
+        logger.info("[Consumer-%d] НАЧАЛО РАБОТЫ", self.consumer_id)
         
-        while self.running:
-            #получаем задачу
+        #останавливается через очередь: task_queue.close() - после оставшихся задач,
+        #task_queue.retire_one() - один любой простаивающий потребитель (уменьшение пула)
+        while True:
+            #получаем задачу - поток спит, пока задачи нет
             task = self.task_queue.get()
             
-            if task is None:
-                continue
+            if task is None: #очередь закрыта и пуста (или потоку пора завершиться) - работы больше не будет
+                break
             
             #обрабатываем
-            print(f"[Consumer-{self.consumer_id}] Обработка задачи #{task.task_id}") 
+            logger.debug("[Consumer-%d] Обработка задачи #%d", self.consumer_id, task.task_id)
             #логирование - сообщает, какой потребитель начал обрабатывать какую задачу 
             start_time = time.time() #засекаем время начала 
-            success, message = self.process_image(task) #вызывается метод process_image - передает задачу - получает 2 значения
+            stage_times = {} #время по этапам заполняет process_image
+            success, message, cache_hit, digest = self.process_image(task, stage_times) #вызывается метод process_image - передает задачу - получает 4 значения
             process_time = time.time() - start_time # вычисление времени обработки
+            self.busy_time += process_time
+            if self.metrics is not None:
+                self.metrics.add_busy(f"consumer-{self.consumer_id}", process_time)
             
             #создаем результат
             result = TaskResult(  
@@ -171,7 +1805,14 @@ class Consumer(threading.Thread):  #создает класс Consumer, кажд
                 success=success,
                 message=message,
                 process_time=process_time,
-                consumer_id=self.consumer_id #id потребителя, который обработал задачу
+                consumer_id=self.consumer_id, #id потребителя, который обработал задачу
+                cache_hit=cache_hit,
+                stage_times=stage_times,
+                queue_wait=max(start_time - task.created_time, 0.0), #от создания задачи до начала обработки
+                priority=task.priority,
+                deadline=task.deadline,
+                deadline_missed=task.deadline is not None and time.time() > task.deadline,
+                digest=digest
             )
             
             #отправляем результат
@@ -179,94 +1820,910 @@ class Consumer(threading.Thread):  #создает класс Consumer, кажд
             self.task_queue.task_done() #сообщает что обработка текущей задачи завершена
             self.processed_count += 1
             
-            status = "ok" if success else "no"
-            print(f"[Consumer-{self.consumer_id}] Задача #{task.task_id} {status} за {process_time:.2f}с")
+            if success:
+                logger.debug("[Consumer-%d] Задача #%d ok за %.2fс", self.consumer_id, task.task_id, process_time)
+            else:
+                logger.warning("[Consumer-%d] Задача #%d: %s", self.consumer_id, task.task_id, message)
         
-        print(f"[Consumer-{self.consumer_id}] ЗАВЕРШЕНИЕ: обработано {self.processed_count}")
+        logger.info("[Consumer-%d] ЗАВЕРШЕНИЕ: обработано %d", self.consumer_id, self.processed_count)
     
-    def process_image(self, task):
+    def process_image(self, task, stage_times=None):
+        times = stage_times if stage_times is not None else {}
         try:
-            #открываем изображение
-            with Image.open(task.input_path) as img:
-                #применяем эффект
-                if task.process_type == ProcessingType.INVERT:
-                    #инверсия
-                    if img.mode == 'RGB':
-                        processed = Image.eval(img, lambda x: 255 - x) #применяет функцию к каждому пикселю
-                    else:
-                        img_rgb = img.convert('RGB')
-                        processed = Image.eval(img_rgb, lambda x: 255 - x) 
-                
-                elif task.process_type == ProcessingType.BLUR:
-                    #размытие
-                    processed = img.filter(ImageFilter.GaussianBlur(radius=2))
-                
-                elif task.process_type == ProcessingType.MIRROR:
-                    #отражение
-                    processed = img.transpose(Image.FLIP_LEFT_RIGHT)
-                
-                else:
-                    return False, f"Неизвестный тип: {task.process_type}"
-                
-                #сохраняем
-                processed.save(task.output_path)
+            #читаем исходник целиком - по этим байтам считается ключ кэша
+            with stage_timer(times, "read"):
+                data = read_input(task) #для архива - срез отображения без копирования
+            fmt = output_format(task.output_path)
+            digest = hashlib.sha256(data).hexdigest() #хэш содержимого - ключ для обоих кэшей
+            
+            cache_hit = False
+            if self.result_cache is None:
+                encoded = self.render(digest, data, task.operations, fmt, times)
+            else:
+                key = ResultCache.make_key(digest, task.operations, fmt)
+                encoded, cache_hit = self.result_cache.get_or_compute(
+                    key, lambda: self.render(digest, data, task.operations, fmt, times))
+            
+            #сохраняем
+            with stage_timer(times, "write"):
+                self.sink.write(task, encoded, journal_callback(self.journal, task, digest))
             
-            return True, f"Сохранено: {task.output_path}"
+            source = "из кэша" if cache_hit else "обработано"
+            return True, f"Сохранено ({source}): {self.sink.location(task)}", cache_hit, digest
         
         except Exception as e:
-            return False, f"Ошибка: {str(e)}"
+            return False, f"Ошибка: {str(e)}", False, None
     
-    def stop(self):
-        self.running = False
+    #декодирование, цепочка эффектов и кодирование в байты нужного формата
+    def render(self, digest, data, operations, fmt, times):
+        big = self.needs_tiling(data)
+        if big:
+            #большое изображение - полосами прямо из байтов файла, мимо кэша изображений.
+            #декодирование идет по полосам вместе с обработкой, поэтому его время входит в "transform"
+            with stage_timer(times, "transform"):
+                processed = self.tiler.apply_data(data, operations)
+            with stage_timer(times, "encode"):
+                return self.tiler.encode(processed, fmt)
+        
+        if self.backend is not None:
+            #пул процессов: весь путь от байтов до байтов в дочернем процессе, поток только ждет
+            encoded, child_times = self.backend.render(data, operations, fmt, self.max_pixels)
+            for stage, seconds in child_times.items():
+                times[stage] = times.get(stage, 0.0) + seconds
+            return encoded
+        
+        #открываем изображение - декодируется один раз на всю цепочку (и один раз на все задачи, если есть кэш)
+        with stage_timer(times, "decode"):
+            if self.image_cache is None:
+                img = decode_image(data, self.max_pixels)
+            else:
+                img, _ = self.image_cache.get_or_decode(digest, data, self.max_pixels)
+        
+        #применяем цепочку эффектов в памяти
+        with stage_timer(times, "transform"):
+            processed = transform_image(img, operations, self.backend, self.tiler)
+        
+        with stage_timer(times, "encode"):
+            return encode_image(processed, fmt)
+    
+    def needs_tiling(self, data): #по заголовку, без декодирования: большое изображение режется на полосы здесь
+        return self.tiler is not None and self.tiler.needs_tiling(data)
+
+
+class _PipelineItem: #задача в пути между этапами конвейера
+    def __init__(self, task):
+        self.task = task
+        self.start_time = time.time()
+        self.data = None #байты исходника
+        self.digest = None
+        self.fmt = None
+        self.key = None #ключ кэша результатов
+        self.img = None
+        self.tiled = False #большое изображение: декодируется полосами на этапе transform
+        self.processed = None
+        self.encoded = None #байты результата
+        self.cache_hit = False
+        self.error = None #первая ошибка - дальше задача идет транзитом до этапа записи
+        self.stage_times = {}
+
+
+class Stage: #один этап конвейера: свой пул потоков между входной и выходной ограниченными очередями
+    def __init__(self, name, func, in_queue, out_queue, num_workers, close_output=True, metrics=None):
+        self.name = name
+        self.func = func #func(item) -> что положить в выходную очередь
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.num_workers = num_workers
+        self.close_output = close_output #закрыть выходную очередь, когда завершится последний поток этапа
+        self.metrics = metrics
+        self.alive = num_workers
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.work, args=(i + 1,), name=f"{name}-{i + 1}")
+                        for i in range(num_workers)]
+    
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+    
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+    
+    def work(self, worker_id):
+        while True:
+            item = self.in_queue.get()
+            if item is None: #предыдущий этап закончил работу
+                break
+            start = time.perf_counter()
+            output = self.func(item, worker_id)
+            if self.metrics is not None:
+                self.metrics.add_busy(f"{self.name}-{worker_id}", time.perf_counter() - start)
+            self.out_queue.put(output)
+            self.in_queue.task_done()
+        
+        with self.lock:
+            self.alive -= 1
+            last = self.alive == 0
+        if last and self.close_output:
+            self.out_queue.close() #конец потока данных передается следующему этапу
+
+
+class StagedPipeline: #конвейер read -> decode -> transform -> encode -> write, у каждого этапа свой пул потоков
+    #чтение и запись - ввод-вывод, поэтому их пулы можно делать большими (сетевое хранилище),
+    #декодирование, эффекты и кодирование - вычисления (эффекты можно вынести в ProcessBackend).
+    #в TaskResult.stage_times видно, какой этап узкое место
+    def __init__(self, task_queue, result_queue, workers=None, queue_size=4, backend=None,
+                 result_cache=None, image_cache=None, tiler=None, metrics=None, sink=None, journal=None):
+        workers = dict({stage: 2 for stage in STAGES}, **(workers or {})) #потоков на этап
+        self.backend = backend
+        self.result_cache = result_cache #в конвейере без ожидания одинаковых задач в полете - только чтение и запись
+        self.image_cache = image_cache
+        self.tiler = tiler
+        self.max_pixels = tiler.max_pixels if tiler is not None else DEFAULT_MAX_PIXELS
+        self.sink = sink or FileSink()
+        self.journal = journal
+        
+        funcs = {"read": self.read, "decode": self.decode, "transform": self.transform,
+                 "encode": self.encode, "write": self.write}
+        self.stages = []
+        in_queue = task_queue
+        for i, name in enumerate(STAGES):
+            last = i == len(STAGES) - 1
+            out_queue = result_queue if last else BlockingQueue(maxsize=queue_size) #ограниченные очереди между этапами
+            self.stages.append(Stage(name, self.timed(name, funcs[name]), in_queue, out_queue,
+                                     workers[name], close_output=not last, metrics=metrics))
+            if metrics is not None and not last:
+                metrics.register_gauge(f"before_{STAGES[i + 1]}", out_queue.size) #очередь перед следующим этапом
+            in_queue = out_queue
+        logger.info("[PIPELINE] Этапы: %s", ", ".join(f"{st.name}={st.num_workers}" for st in self.stages))
+    
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+    
+    def join(self): #ждет, пока все этапы дообработают закрытую очередь задач
+        for stage in self.stages:
+            stage.join()
+    
+    #обертка этапа: замер времени и пропуск задач с ошибкой
+    @staticmethod
+    def timed(name, func):
+        def run(item, worker_id):
+            if isinstance(item, ImageTask):
+                item = _PipelineItem(item)
+            if item.error is None or name == "write":
+                try:
+                    with stage_timer(item.stage_times, name):
+                        result = func(item, worker_id)
+                    if result is not None:
+                        return result
+                except Exception as e:
+                    item.error = e
+            return item
+        return run
+    
+    def read(self, item, worker_id):
+        task = item.task
+        item.data = read_input(task)
+        item.fmt = output_format(task.output_path)
+        item.digest = hashlib.sha256(item.data).hexdigest()
+        if self.result_cache is not None:
+            item.key = ResultCache.make_key(item.digest, task.operations, item.fmt)
+            item.encoded = self.result_cache.get(item.key)
+            item.cache_hit = item.encoded is not None #готовый результат - сразу на запись
+    
+    def decode(self, item, worker_id):
+        if item.cache_hit:
+            return
+        if self.tiler is not None and self.tiler.needs_tiling(item.data):
+            item.tiled = True #целиком не декодируем - полосы прочитает TiledProcessor
+            return
+        if self.image_cache is None:
+            item.img = decode_image(item.data, self.max_pixels)
+        else:
+            item.img, _ = self.image_cache.get_or_decode(item.digest, item.data, self.max_pixels)
+    
+    def transform(self, item, worker_id):
+        if item.cache_hit:
+            return
+        if item.tiled:
+            item.processed = self.tiler.apply_data(item.data, item.task.operations)
+        else:
+            item.processed = transform_image(item.img, item.task.operations, self.backend, self.tiler)
+        item.img = None #исходник больше не нужен
+    
+    def encode(self, item, worker_id):
+        if item.cache_hit:
+            return
+        if item.tiled:
+            item.encoded = self.tiler.encode(item.processed, item.fmt)
+        else:
+            item.encoded = encode_image(item.processed, item.fmt)
+        item.processed = None
+        if self.result_cache is not None:
+            self.result_cache.put(item.key, item.encoded)
+    
+    def write(self, item, worker_id): #последний этап возвращает TaskResult для ResultCollector
+        task = item.task
+        if item.error is None:
+            try:
+                self.sink.write(task, item.encoded, journal_callback(self.journal, task, item.digest))
+            except Exception as e:
+                item.error = e
+        if item.error is None:
+            source = "из кэша" if item.cache_hit else "обработано"
+            success, message = True, f"Сохранено ({source}): {self.sink.location(task)}"
+        else:
+            success, message = False, f"Ошибка: {item.error}"
+        return TaskResult(
+            task_id=task.task_id,
+            success=success,
+            message=message,
+            process_time=time.time() - item.start_time,
+            consumer_id=worker_id, #номер потока записи
+            cache_hit=item.cache_hit,
+            stage_times=item.stage_times,
+            queue_wait=max(item.start_time - task.created_time, 0.0),
+            priority=task.priority,
+            deadline=task.deadline,
+            deadline_missed=task.deadline is not None and time.time() > task.deadline,
+            digest=item.digest if success else None
+        )
+
+
+#q-й перцентиль (0-100) списка чисел, линейная интерполяция между соседними значениями
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    low = math.floor(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+class Histogram: #распределение замеров для перцентилей. хранит не больше max_samples значений (случайная выборка)
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self.samples = []
+        self.count = 0
+        self.total = 0.0
+        self.lock = threading.Lock()
+        self.rng = random.Random()
+    
+    def observe(self, value):
+        with self.lock:
+            self.count += 1
+            self.total += value
+            if len(self.samples) < self.max_samples:
+                self.samples.append(value)
+            else:
+                index = self.rng.randrange(self.count) #резервуарная выборка - каждый замер попадает с равной вероятностью
+                if index < self.max_samples:
+                    self.samples[index] = value
+    
+    def snapshot(self):
+        with self.lock:
+            samples = list(self.samples)
+            count, total = self.count, self.total
+        return {"count": count, "sum": total, "p50": percentile(samples, 50),
+                "p95": percentile(samples, 95), "p99": percentile(samples, 99)}
+
+
+class Metrics: #общий реестр метрик запуска: гистограммы задержек, глубина очередей, загрузка потоков
+    def __init__(self):
+        self.start_time = time.time()
+        self.histograms = {} #имя -> Histogram ("queue_wait", "total" и этапы из STAGES)
+        self.gauges = {} #имя -> функция без аргументов, текущее значение (например размер очереди)
+        self.busy = {} #имя потока -> секунды работы
+        self.deadline_misses = 0 #задачи, готовые позже своего deadline
+        self.lock = threading.Lock()
+    
+    def histogram(self, name):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            return self.histograms[name]
+    
+    def register_gauge(self, name, func):
+        with self.lock:
+            self.gauges[name] = func
+    
+    def add_busy(self, worker, seconds): #поток worker был занят работой seconds секунд
+        with self.lock:
+            self.busy[worker] = self.busy.get(worker, 0.0) + seconds
+    
+    def observe_result(self, result): #раскладывает времена одной задачи по гистограммам
+        self.histogram("queue_wait").observe(result.queue_wait)
+        self.histogram("total").observe(result.process_time)
+        for stage, seconds in result.stage_times.items():
+            self.histogram(stage).observe(seconds)
+        #полная задержка (ожидание + обработка) по классам приоритета - ее и сокращает планировщик
+        self.histogram(f"priority_{result.priority}").observe(result.queue_wait + result.process_time)
+        if result.deadline_missed:
+            with self.lock:
+                self.deadline_misses += 1
+    
+    def snapshot(self):
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        with self.lock:
+            histograms = dict(self.histograms)
+            gauges = dict(self.gauges)
+            busy = dict(self.busy)
+            deadline_misses = self.deadline_misses
+        return {
+            "timestamp": time.time(),
+            "elapsed": elapsed,
+            "latency": {name: h.snapshot() for name, h in histograms.items()},
+            "queue_depth": {name: func() for name, func in gauges.items()},
+            "utilization": {worker: seconds / elapsed for worker, seconds in busy.items()}, #доля времени в работе
+            "deadline_misses": deadline_misses,
+        }
+    
+    def to_prometheus(self): #текстовый формат Prometheus (node_exporter textfile collector)
+        snap = self.snapshot()
+        lines = ["# TYPE image_processor_latency_seconds summary"]
+        for name, h in snap["latency"].items():
+            for q in ("50", "95", "99"):
+                lines.append(f'image_processor_latency_seconds{{stage="{name}",quantile="0.{q}"}} {h["p" + q]:.6f}')
+            lines.append(f'image_processor_latency_seconds_sum{{stage="{name}"}} {h["sum"]:.6f}')
+            lines.append(f'image_processor_latency_seconds_count{{stage="{name}"}} {h["count"]}')
+        lines.append("# TYPE image_processor_queue_depth gauge")
+        for name, value in snap["queue_depth"].items():
+            lines.append(f'image_processor_queue_depth{{queue="{name}"}} {value}')
+        lines.append("# TYPE image_processor_worker_utilization gauge")
+        for worker, value in snap["utilization"].items():
+            lines.append(f'image_processor_worker_utilization{{worker="{worker}"}} {value:.4f}')
+        lines.append("# TYPE image_processor_deadline_misses_total counter")
+        lines.append(f"image_processor_deadline_misses_total {snap['deadline_misses']}")
+        return "\n".join(lines) + "\n"
+    
+    def write(self, path): #формат по расширению: .json - JSON, иначе Prometheus
+        if path.endswith(".json"):
+            text = json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        else:
+            text = self.to_prometheus()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path) #читатель метрик не увидит недописанный файл
+
+
+class MetricsExporter(threading.Thread): #периодически сохраняет метрики в файл
+    def __init__(self, metrics, path, interval=5.0):
+        super().__init__(daemon=True)
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+    
+    def run(self):
+        while not self.stopped.wait(self.interval): #спит interval секунд или до stop()
+            self.metrics.write(self.path)
+    
+    def stop(self): #останавливает выгрузку и сохраняет итоговые значения
+        self.stopped.set()
+        self.join()
+        self.metrics.write(self.path)
+
+
+#сколько ядер доступно процессу (в контейнере может быть меньше, чем на машине)
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class ConsumerPool(threading.Thread): #менеджер потребителей: раз в interval секунд добавляет или выводит потоки
+    #увеличивает пул, когда в очереди копятся задачи, потребители заняты и есть свободный CPU;
+    #уменьшает, когда очередь пуста и потребители простаивают. выведенный поток дообрабатывает текущую задачу
+    def __init__(self, task_queue, consumer_factory, min_consumers=1, max_consumers=None, interval=1.0,
+                 busy_high=0.75, busy_low=0.25):
+        super().__init__(name="consumer-pool", daemon=True)
+        self.task_queue = task_queue
+        self.consumer_factory = consumer_factory #consumer_factory(consumer_id) -> новый Consumer
+        self.min_consumers = max(min_consumers, 1)
+        self.max_consumers = max(max_consumers or 2 * available_cpus(), self.min_consumers)
+        self.interval = interval
+        self.busy_high = busy_high #выше этой загрузки потоки не успевают
+        self.busy_low = busy_low #ниже - простаивают
+        self.consumers = [] #все созданные потребители, включая завершившиеся
+        self.next_id = itertools.count(1)
+        self.stopped = threading.Event()
+        self.decisions = [] #(время, число потребителей, причина) - для настройки политики
+        self.last_check = None #(время, суммарная занятость потоков, процессорное время процесса)
+    
+    def alive(self): #работающие потребители без тех, кому уже отправлен сигнал завершения
+        return sum(1 for c in self.consumers if c.is_alive()) - self.task_queue.retire_requests
+    
+    def start(self):
+        for _ in range(self.min_consumers):
+            self.add_consumer()
+        self.last_check = (time.time(), self.total_busy(), time.process_time())
+        super().start()
+    
+    def add_consumer(self):
+        consumer = self.consumer_factory(next(self.next_id))
+        self.consumers.append(consumer)
+        consumer.start()
+    
+    def total_busy(self):
+        return sum(c.busy_time for c in self.consumers)
+    
+    def run(self):
+        while not self.stopped.wait(self.interval): #спит interval секунд или до stop()
+            self.adjust()
+    
+    def adjust(self):
+        now, busy, cpu_time = time.time(), self.total_busy(), time.process_time()
+        last_time, last_busy, last_cpu = self.last_check
+        self.last_check = (now, busy, cpu_time)
+        elapsed = max(now - last_time, 1e-9)
+        count = self.alive()
+        if count <= 0:
+            return
+        
+        depth = self.task_queue.size()
+        utilization = (busy - last_busy) / (elapsed * count) #доля времени, которую потребители работали
+        cpus = available_cpus()
+        cpu_used = (cpu_time - last_cpu) / (elapsed * cpus) #доля доступных ядер, занятая этим процессом
+        if hasattr(os, "getloadavg"):
+            cpu_used = max(cpu_used, os.getloadavg()[0] / cpus) #учитываем и другие процессы на машине
+        
+        reason = (f"очередь={depth}, загрузка потоков={utilization:.0%}, CPU={cpu_used:.0%}")
+        if depth > 0 and utilization >= self.busy_high and cpu_used < 0.9 and count < self.max_consumers:
+            self.add_consumer()
+            self.record(count + 1, f"+1: {reason}")
+        elif depth == 0 and utilization <= self.busy_low and count > self.min_consumers:
+            self.task_queue.retire_one()
+            self.record(count - 1, f"-1: {reason}")
+    
+    def record(self, count, reason):
+        self.decisions.append((time.time(), count, reason))
+        logger.info("[POOL] потребителей: %d (%s)", count, reason)
+    
+    def join(self): #после закрытия очереди задач: останавливает менеджер и ждет всех потребителей
+        self.stopped.set()
+        super().join()
+        for consumer in self.consumers:
+            consumer.join()
 
 
 class ResultCollector: #собирает и анализирует результаты обработки от всех потребителей 
     
-    def __init__(self, result_queue, num_expected): 
+    def __init__(self, result_queue, num_expected, metrics=None, stream=None): 
         self.result_queue = result_queue #запоминает ссылку на очередь, откуда будет забирать результаты
+        self.stream = stream #ограниченная очередь - каждый результат сразу передается дальше (process_batch)
         self.num_expected = num_expected #сколько результатов должно быть собрано 
-        self.results = [] #пустой список, куда будут складываться полученные результаты
+        #при потоковой выдаче результаты забирает читатель, а здесь копятся только сводные числа: список всех
+        #результатов рос бы без предела на долгом или бесконечном источнике
+        self.keep_results = stream is None
+        self.results = [] #пустой список, куда будут складываться полученные результаты (без stream)
+        self.failures = [] #неудачные задачи - их всегда немного, печатаются в статистике
+        self.count = 0
+        self.successful = 0
+        self.cache_hits = 0
+        self.total_time = 0.0 #сумма process_time
+        self.priorities = set()
+        self.with_deadline = 0
+        self.missed_deadlines = 0
+        self.stage_totals = {} #этап -> [сумма секунд, число задач]
+        self.metrics = metrics if metrics is not None else Metrics() #гистограммы задержек по этапам
+        self.skipped = 0 #исходники, пропущенные производителями по журналу выполненных
         self.running = True
     
+    #работает параллельно с потребителями, пока очередь результатов не закроют и не дочитают
     def collect(self):
-        print("\n[COLLECTOR] Начинаю сбор результатов") 
+        logger.info("[COLLECTOR] Начинаю сбор результатов")
         
-        while len(self.results) < self.num_expected: #продолжается, пока количество собранных результатов меньше ожидаемого 
+        while True:
             result = self.result_queue.get() #получение результата из очереди 
-            if result:
-                self.results.append(result) 
-                print(f"[COLLECTOR] Получен результат задачи #{result.task_id}")
+            if result is None: #все потребители завершились и очередь пуста
+                break
+            self.account(result)
+            self.metrics.observe_result(result)
+            if self.stream is not None:
+                try:
+                    self.stream.put(result) #блокируется, если читатель не успевает - обратное давление на обработку
+                except Exception:
+                    self.stream = None #читатель закрыл поток результатов - дособираем без передачи
+            logger.debug("[COLLECTOR] Получен результат задачи #%d (%d/%s)", result.task_id, self.count,
+                         self.num_expected if self.num_expected is not None else "?")
         
-        print("[COLLECTOR] Сбор завершен")
+        logger.info("[COLLECTOR] Сбор завершен")
+    
+    def account(self, result): #сводные числа для print_stats - без хранения самого результата
+        if self.keep_results:
+            self.results.append(result)
+        self.count += 1
+        if result.success:
+            self.successful += 1
+        else:
+            self.failures.append(result)
+        self.cache_hits += bool(result.cache_hit)
+        self.total_time += result.process_time
+        self.priorities.add(result.priority)
+        if result.deadline is not None:
+            self.with_deadline += 1
+            self.missed_deadlines += bool(result.deadline_missed)
+        for stage, seconds in result.stage_times.items():
+            total = self.stage_totals.setdefault(stage, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
     
-    def print_stats(self):
+    #wall_time - реальное время всего запуска, cores - сколько ядер было задействовано.
+    #details - построчный список задач (при потоковой выдаче его уже напечатал читатель, а результатов тут нет)
+    def print_stats(self, wall_time=None, cores=None, details=True):
         print("\n" + "="*60)
         print("СТАТИСТИКА ОБРАБОТКИ")
         print("="*60)
         
-        successful = sum(1 for r in self.results if r.success)
-        failed = len(self.results) - successful
+        failed = self.count - self.successful
         
-        print(f"Всего задач: {len(self.results)}")
-        print(f"Успешно: {successful}")
+        print(f"Всего задач: {self.count}")
+        print(f"Успешно: {self.successful}")
         print(f"Ошибок: {failed}")
+        if self.skipped:
+            print(f"Пропущено (уже выполнено в прошлых запусках): {self.skipped}")
         
-        if self.results:
-            total_time = sum(r.process_time for r in self.results)
-            avg_time = total_time / len(self.results)
-            print(f"Общее время: {total_time:.2f}с")
+        if self.count:
+            avg_time = self.total_time / self.count
+            print(f"Общее время: {self.total_time:.2f}с")
             print(f"Среднее время: {avg_time:.2f}с")
+            
+            #перцентили показывают хвост задержек, которого не видно по среднему
+            snapshot = self.metrics.snapshot()
+            print("Перцентили, мс:            p50      p95      p99")
+            for name in ("total", "queue_wait") + STAGES:
+                h = snapshot["latency"].get(name)
+                if h and h["count"]:
+                    print(f"  {name:<20} {h['p50'] * 1000:8.1f} {h['p95'] * 1000:8.1f} {h['p99'] * 1000:8.1f}")
+            #полная задержка по классам приоритета и просроченные задачи
+            priorities = sorted(self.priorities, reverse=True)
+            if len(priorities) > 1 or self.with_deadline:
+                print("Задержка по приоритетам, мс:  p50      p95      p99   задач")
+                for priority in priorities:
+                    h = snapshot["latency"][f"priority_{priority}"]
+                    print(f"  priority {priority:<13} {h['p50'] * 1000:8.1f} {h['p95'] * 1000:8.1f} "
+                          f"{h['p99'] * 1000:8.1f} {h['count']:6d}")
+                if self.with_deadline:
+                    missed = self.missed_deadlines
+                    print(f"Просрочено: {missed} из {self.with_deadline} задач со сроком ({missed / self.with_deadline:.0%})")
+            if snapshot["utilization"]:
+                print("Загрузка потоков: " + ", ".join(
+                    f"{worker} {value:.0%}" for worker, value in sorted(snapshot["utilization"].items())))
+            print(f"Кэш: попаданий {self.cache_hits}, промахов {self.count - self.cache_hits}")
+            
+            #среднее время по этапам - самый долгий этап и есть узкое место
+            stage_avg = {}
+            for stage in STAGES:
+                if stage in self.stage_totals:
+                    total, count = self.stage_totals[stage]
+                    stage_avg[stage] = total / count
+            if stage_avg:
+                slowest = max(stage_avg, key=stage_avg.get)
+                print("Этапы (среднее): " + ", ".join(f"{k} {v * 1000:.1f}мс" for k, v in stage_avg.items()))
+                print(f"Самый долгий этап: {slowest}")
+        
+        if self.count and wall_time:
+            throughput = self.count / wall_time #изображений в секунду
+            print(f"Время запуска: {wall_time:.2f}с")
+            print(f"Пропускная способность: {throughput:.2f} изобр/с")
+            if cores:
+                print(f"На одно ядро: {throughput / cores:.2f} изобр/с (ядер: {cores})")
         
+        if not details:
+            return
         print("\nДетали по задачам:")
         print("-" * 60)
-        for r in self.results:
+        for r in (self.results if self.keep_results else self.failures):
             status = "✓" if r.success else "✗"
             print(f"[{status}] Задача #{r.task_id}: Consumer-{r.consumer_id} - {r.process_time:.2f}с")
             if not r.success:
                 print(f"      Ошибка: {r.message}")
 
 
-def main():
+#один запуск обработки без вопросов пользователю: создает очереди, производителей, потребителей
+#(или конвейер) и сборщик, ждет завершения и возвращает (collector, wall_time, cores).
+#кэши передаются готовыми объектами, None - без кэша
+def run_batch(input_folder, output_folder, operations, num_tasks=None, mode=ProducerMode.ALL,
+              num_producers=1, num_consumers=3, execution=ExecutionMode.THREADS,
+              num_processes=None, pipeline_workers=None, result_cache=None, image_cache=None,
+              tile_memory=256 * 1024 * 1024, task_queue_size=None, result_queue_size=20,
+              metrics_file=None, metrics_interval=5.0, autoscale=False, min_consumers=1,
+              max_consumers=None, sink=None, journal=None, scheduling=SchedulingMode.FIFO, priority=0,
+              deadline=None, result_stream=None, max_pixels=DEFAULT_MAX_PIXELS, spill_dir=None):
+    operations = normalize_operations(operations) #строка "invert+blur:radius=3" тоже подходит
+    if mode == ProducerMode.RANDOM:
+        if num_tasks is None: #выборка с повторами сама не кончается
+            raise ValueError("Для случайной выборки нужно число задач num_tasks")
+        num_producers = 1 #случайной выборке нужен полный список - его строит один производитель
+    
+    sink = sink or FileSink() #куда сохранять результаты
+    backend = tiler = exporter = None
+    #пул процессов, потоки полос, файл метрик, отображения архивов освобождаются и при ошибке
+    try:
+        cores = min(num_consumers, os.cpu_count() or 1) #потоки делят один процесс
+        if execution == ExecutionMode.PROCESSES:
+            backend = ProcessBackend(num_processes)
+        elif execution == ExecutionMode.PIPELINE:
+            pipeline_workers = pipeline_workers or {}
+            cores = min(pipeline_workers.get("transform", 2), os.cpu_count() or 1)
+    
+        #большие изображения - полосами параллельно в общем пуле
+        tiler = TiledProcessor(tile_memory, backend=backend, max_pixels=max_pixels, spill_dir=spill_dir)
+    
+        if autoscale:
+            max_consumers = max_consumers or 2 * available_cpus()
+        if backend is not None:
+            #одновременно в пуле не больше задач, чем потоков Consumer - занятых процессов не больше их
+            cores = min(max_consumers if autoscale else num_consumers, backend.num_workers)
+        if task_queue_size is None: #по паре задач на потребителя, чтобы никто не простаивал
+            task_queue_size = 2 * (max_consumers if autoscale else num_consumers)
+            if scheduling != SchedulingMode.FIFO:
+                task_queue_size = max(task_queue_size, 256) #переставлять можно только то, что уже в очереди
+    
+        #создаем очереди
+        task_queue = make_task_queue(scheduling, task_queue_size) #очередь задач (FIFO или по приоритету)
+        result_queue = BlockingQueue(maxsize=result_queue_size)  #очередь результатов
+    
+        #метрики: глубина очередей, загрузка потоков, задержки по этапам (их наполняет collector)
+        metrics = Metrics()
+        metrics.register_gauge("tasks", task_queue.size)
+        metrics.register_gauge("results", result_queue.size)
+        if metrics_file:
+            exporter = MetricsExporter(metrics, metrics_file, metrics_interval)
+    
+        #создаем producers - общий обход папок и общий счетчик номеров задач
+        source = open_source(input_folder) #папка, tar/zip-архив или пакет PackSink
+        scanner = source.scanner()
+        task_ids = itertools.count()
+        producers = []
+        for i in range(num_producers):
+            producer = Producer(task_queue, input_folder, output_folder, operations, num_tasks,
+                                mode, scanner, task_ids, producer_id=i + 1, source=source, journal=journal,
+                                priority=priority, deadline=deadline)
+            producers.append(producer)
+    
+        #создаем consumers (или один конвейер по этапам вместо них)
+        consumers = []
+        pipeline = None
+        pool = None
+        if execution == ExecutionMode.PIPELINE:
+            pipeline = StagedPipeline(task_queue, result_queue, pipeline_workers, backend=backend,
+                                      result_cache=result_cache, image_cache=image_cache, tiler=tiler,
+                                      metrics=metrics, sink=sink, journal=journal)
+        elif autoscale:
+            #число потребителей меняется во время работы в пределах [min_consumers, max_consumers]
+            pool = ConsumerPool(task_queue, lambda consumer_id: Consumer(
+                consumer_id, task_queue, result_queue, backend, result_cache, image_cache, tiler, metrics,
+                sink, journal),
+                min_consumers, max_consumers)
+        else:
+            for i in range(num_consumers):
+                consumer = Consumer(i + 1, task_queue, result_queue, backend, result_cache, image_cache,
+                                    tiler, metrics, sink, journal)
+                consumers.append(consumer)
+    
+        #создаем collector
+        collector = ResultCollector(result_queue, num_tasks, metrics, result_stream)
+    
+        start_time = time.time() #засекаем время всего запуска
+        metrics.start_time = start_time
+        if exporter is not None:
+            exporter.start()
+    
+        #запускаем producers
+        for producer in producers:
+            producer.start()
+    
+        #запускаем consumers
+        for consumer in consumers:
+            consumer.start()
+        if pipeline is not None:
+            pipeline.start()
+        if pool is not None:
+            pool.start()
+    
+        #собираем результаты одновременно с обработкой - очередь результатов не переполняется
+        collector_thread = threading.Thread(target=collector.collect)
+        collector_thread.start()
+    
+        #ждем завершения producers
+        for producer in producers:
+            producer.join()
+        logger.info("[MAIN] Producers завершили работу")
+        collector.skipped = sum(p.tasks_skipped for p in producers)
+    
+        #новых задач не будет: consumers дообработают очередь и завершатся сами
+        task_queue.close()
+    
+        #ждем завершения consumers
+        for consumer in consumers:
+            consumer.join()
+        if pipeline is not None:
+            pipeline.join()
+        if pool is not None:
+            pool.join()
+        logger.info("[MAIN] Consumers завершили работу")
+    
+        #результатов больше не будет: collector дочитает очередь и завершится
+        result_queue.close()
+        collector_thread.join()
+        sink.close() #пакетный вывод дописывает хвост очереди записи (и отмечает его в журнале)
+        wall_time = time.time() - start_time
+        
+        #производитель не смог обойти источник - запуск не удался, даже если часть задач выполнена
+        for producer in producers:
+            if producer.error is not None:
+                raise producer.error
+    finally:
+        sink.close() #повторный вызов ничего не делает
+        if journal is not None:
+            journal.close()
+        if exporter is not None and exporter.is_alive():
+            exporter.stop() #итоговые метрики
+        if tiler is not None:
+            tiler.shutdown()
+        if backend is not None:
+            backend.shutdown() #завершаем процессы пула
+        close_sources() #снимаем отображения архивов
+    
+    return collector, wall_time, cores
+
+
+class BatchStream: #запуск run_batch в фоне, результаты - по мере готовности через обычный или асинхронный итератор
+    #между обработкой и читателем не больше buffer_size результатов: если читатель медленный,
+    #обработка притормаживает, а не копит результаты в памяти. после обхода доступны collector, wall_time, cores
+    def __init__(self, args, options, buffer_size=16):
+        self.stream = BlockingQueue(maxsize=buffer_size)
+        self.collector = None
+        self.wall_time = None
+        self.cores = None
+        self.error = None
+        self.thread = threading.Thread(target=self._run, args=(args, options), name="batch")
+        self.thread.start()
+    
+    def _run(self, args, options):
+        try:
+            self.collector, self.wall_time, self.cores = run_batch(*args, result_stream=self.stream, **options)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.stream.close() #читатель дочитает остаток и получит конец
+    
+    def _next(self): #следующий результат или None, когда запуск завершен
+        result = self.stream.get()
+        if result is None:
+            self.thread.join()
+            if self.error is not None:
+                raise self.error
+        return result
+    
+    def __iter__(self):
+        try:
+            while True:
+                result = self._next()
+                if result is None:
+                    return
+                yield result
+        finally:
+            self.close()
+    
+    async def __aiter__(self): #как __iter__: break или исключение в async for закрывают поток результатов
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                result = await loop.run_in_executor(None, self._next) #ожидание - в пуле потоков, цикл событий не блокируется
+                if result is None:
+                    return
+                yield result
+        finally:
+            self.close()
+    
+    def close(self): #читатель больше не нужен: оставшиеся задачи досчитываются в фоне без передачи результатов
+        self.stream.close()
+    
+    async def aclose(self): #для async with contextlib.aclosing(stream) и явного закрытия из корутины
+        self.close()
+    
+    def wait(self): #дождаться конца запуска: непрочитанные результаты больше не нужны (они есть в collector)
+        self.close()
+        self.thread.join()
+        return self.collector
+
+
+#обработка без вопросов пользователю с потоковой выдачей результатов:
+#    for result in process_batch("input_images", "output_images", "invert+blur:radius=3"):
+#        ...  #результат готов - можно запускать следующий этап, не дожидаясь всего пакета
+#из корутины: async with contextlib.aclosing(process_batch(...)) as stream: async for result in stream: ...
+#operations - строка parse_operations или то, что принимает normalize_operations,
+#остальные параметры - как у run_batch
+def process_batch(input_folder, output_folder, operations, buffer_size=16, **options):
+    if isinstance(operations, str):
+        operations = parse_operations(operations)
+    return BatchStream((input_folder, output_folder, operations), options, buffer_size)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Параллельная обработка изображений. Без параметров - интерактивный режим")
+    parser.add_argument("--input", default="input_images", help="папка, tar/zip-архив или пакет PackSink")
+    parser.add_argument("--output", default="output_images", help="папка результатов (или пакета при --sink pack)")
+    parser.add_argument("--ops", default="invert", help="цепочка обработки, например invert+blur:radius=3+mirror")
+    parser.add_argument("--mode", choices=[m.name.lower() for m in ProducerMode], default="all",
+                        help="all - каждый файл один раз, random - случайная выборка --tasks задач")
+    parser.add_argument("--tasks", type=int, help="сколько задач (в режиме all - ограничение)")
+    parser.add_argument("--producers", type=int, default=2)
+    parser.add_argument("--consumers", type=int, default=3)
+    parser.add_argument("--execution", choices=[m.value for m in ExecutionMode], default="threads")
+    parser.add_argument("--processes", type=int, help="размер пула процессов (--execution processes)")
+    parser.add_argument("--autoscale", action="store_true", help="число потребителей по нагрузке")
+    parser.add_argument("--min-consumers", type=int, default=1)
+    parser.add_argument("--max-consumers", type=int)
+    parser.add_argument("--scheduling", choices=[m.value for m in SchedulingMode], default="fifo")
+    parser.add_argument("--priority", type=int, default=0, help="приоритет задач")
+    parser.add_argument("--deadline", type=float, help="срок на задачу, секунд от ее создания")
+    parser.add_argument("--sink", choices=["files", "pack"], default="files", help="отдельные файлы или пакет")
+    parser.add_argument("--cache-dir", help="дисковый кэш результатов (без параметра - только в памяти)")
+    parser.add_argument("--no-cache", action="store_true", help="без кэшей результатов и изображений")
+    parser.add_argument("--journal", help="журнал выполненных задач - повторный запуск их пропустит")
+    parser.add_argument("--metrics", help="файл метрик (.json или Prometheus)")
+    parser.add_argument("--max-pixels", type=int, default=DEFAULT_MAX_PIXELS,
+                        help="предел размера исходника в пикселях, 0 - без предела")
+    parser.add_argument("--spill-dir", help="папка временных файлов больших изображений (не tmpfs)")
+    parser.add_argument("--buffer", type=int, default=16, help="сколько готовых результатов держать до вывода")
+    parser.add_argument("--json", action="store_true", help="результаты строками JSON в stdout, статистика - в stderr")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+    if args.mode == "random" and args.tasks is None: #случайная выборка без числа задач не закончится
+        parser.error("для --mode random нужно указать --tasks")
+    return args
+
+
+#запуск без вопросов: результат выводится сразу после готовности, в конце - статистика.
+#код возврата 1, если были ошибки
+def run_cli(args):
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(threadName)s %(message)s")
+    if not os.path.exists(args.input) and ":" not in args.input: #с префиксом (tar:...) путь проверит open_source
+        print(f"Источник не найден: {args.input}", file=sys.stderr)
+        return 2
+    
+    result_cache = image_cache = None
+    if not args.no_cache:
+        result_cache = ResultCache(64 * 1024 * 1024, args.cache_dir)
+        image_cache = DecodedImageCache(256 * 1024 * 1024)
+    
+    batch = process_batch(
+        args.input, args.output, args.ops, buffer_size=args.buffer, num_tasks=args.tasks,
+        mode=ProducerMode[args.mode.upper()], num_producers=args.producers, num_consumers=args.consumers,
+        execution=ExecutionMode(args.execution), num_processes=args.processes, result_cache=result_cache,
+        image_cache=image_cache, metrics_file=args.metrics, autoscale=args.autoscale,
+        min_consumers=args.min_consumers, max_consumers=args.max_consumers,
+        sink=PackSink(args.output) if args.sink == "pack" else FileSink(),
+        journal=CompletionJournal(args.journal) if args.journal else None,
+        scheduling=SchedulingMode(args.scheduling), priority=args.priority, deadline=args.deadline,
+        max_pixels=args.max_pixels or None, spill_dir=args.spill_dir)
+    
+    failed = 0
+    for result in batch:
+        failed += not result.success
+        if args.json:
+            print(json.dumps(result.to_dict(), ensure_ascii=False), flush=True)
+        else:
+            status = "✓" if result.success else "✗"
+            print(f"[{status}] Задача #{result.task_id}: {result.message}", flush=True)
+    
+    out = sys.stderr if args.json else sys.stdout #stdout в режиме --json - только результаты
+    with contextlib.redirect_stdout(out):
+        batch.collector.print_stats(batch.wall_time, batch.cores, details=False) #задачи уже напечатаны выше
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv: #параметры командной строки - запуск без вопросов (для планировщиков заданий)
+        return run_cli(parse_args(argv))
     
     print("="*60)
     print("ПАРАЛЛЕЛЬНАЯ ОБРАБОТКА ИЗОБРАЖЕНИЙ")
@@ -274,82 +2731,134 @@ def main():
     print("="*60)
     
     #настройки
-    INPUT_FOLDER = "input_images"
+    INPUT_FOLDER = "input_images"  #папка, tar/zip-архив или пакет PackSink (папка с index.jsonl)
     OUTPUT_FOLDER = "output_images"
     NUM_TASKS = 10           #количество задач
-    NUM_CONSUMERS = 3        #количество потребителей
+    NUM_CONSUMERS = 3        #количество потребителей (без автомасштабирования)
+    AUTOSCALE = True         #число потребителей подбирается по очереди и загрузке
+    MIN_CONSUMERS = 1
+    MAX_CONSUMERS = 2 * available_cpus()
+    NUM_PRODUCERS = 2        #количество производителей в режиме "все файлы" (делят между собой обход папок)
+    PIPELINE_WORKERS = {"read": 4, "decode": 2, "transform": 2, "encode": 2, "write": 4} #потоков на этап конвейера
+    CACHE_FOLDER = "cache"   #дисковый уровень кэша результатов
+    CACHE_MEMORY = 64 * 1024 * 1024 #объем кэша результатов в памяти, байт
+    IMAGE_CACHE_MEMORY = 256 * 1024 * 1024 #объем кэша декодированных изображений, байт
+    TILE_MEMORY = 256 * 1024 * 1024 #изображения, которым нужно больше памяти, обрабатываются полосами
+    MAX_PIXELS = None #предел размера исходника: гигапиксельные сканы - не «бомба», их обрабатываем полосами
+    LOG_LEVEL = logging.WARNING #INFO - жизненный цикл потоков, DEBUG - каждая задача и каждая операция с очередью
+    PACK_OUTPUT = False      #True - результаты дописываются в сегменты пакета в OUTPUT_FOLDER вместо отдельных файлов
+    METRICS_FILE = "metrics.prom" #метрики во время работы (.json - в JSON), None - не сохранять
+    SCHEDULING = SchedulingMode.COST #мелкие задачи не ждут за крупными размытиями (FIFO - в порядке поступления)
+    JOURNAL_FILE = os.path.join(OUTPUT_FOLDER, "journal.jsonl") #выполненные задачи - повторный запуск "всех файлов" их пропустит, None - без журнала
+    
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(threadName)s %(message)s")
     
     #выбираем тип обработки
     print("\nВыберите тип обработки:")
     print("1 - Инверсия (негатив)")
     print("2 - Размытие")
     print("3 - Отражение")
+    print("4 - Гамма-коррекция")
+    print("Можно выбрать цепочку через запятую, например 1,3,2")
     
-    choice = input("Ваш выбор (1-3): ").strip()
-    
-    if choice == "1":
-        process_type = ProcessingType.INVERT
-        print("Выбрана: ИНВЕРСИЯ")
-    elif choice == "2":
-        process_type = ProcessingType.BLUR
-        print("Выбрано: РАЗМЫТИЕ")
-    elif choice == "3":
-        process_type = ProcessingType.MIRROR
-        print("Выбрано: ОТРАЖЕНИЕ")
-    else:
-        print("Неверный выбор. Использую ИНВЕРСИЮ")
-        process_type = ProcessingType.INVERT
+    choices = {
+        "1": (ProcessingType.INVERT, "ИНВЕРСИЯ"),
+        "2": (ProcessingType.BLUR, "РАЗМЫТИЕ"),
+        "3": (ProcessingType.MIRROR, "ОТРАЖЕНИЕ"),
+        "4": (ProcessingType.GAMMA, "ГАММА"),
+    }
     
-    #создаем очереди
-    task_queue = BlockingQueue(maxsize=5)     #очередь задач
-    result_queue = BlockingQueue(maxsize=20)  #очередь результатов
+    choice = input("Ваш выбор (1-4): ").strip()
     
-    #создаем producer
-    producer = Producer(task_queue, INPUT_FOLDER, OUTPUT_FOLDER, 
-                       process_type, NUM_TASKS)
+    operations = []
+    for item in choice.split(","):
+        item = item.strip()
+        if item not in choices:
+            print(f"Неверный выбор '{item}', пропускаю")
+            continue
+        process_type, title = choices[item]
+        params = {}
+        if process_type == ProcessingType.BLUR:
+            radius = input("Радиус размытия (по умолчанию 2): ").strip()
+            if radius:
+                params["radius"] = float(radius)
+        elif process_type == ProcessingType.GAMMA:
+            gamma = input("Гамма (по умолчанию 1.0): ").strip()
+            if gamma:
+                params["gamma"] = float(gamma)
+        operations.append(Operation(process_type, params))
+        print(f"Добавлено: {title}")
     
-    #создаем consumers
-    consumers = []
-    for i in range(NUM_CONSUMERS):
-        consumer = Consumer(i + 1, task_queue, result_queue)
-        consumers.append(consumer)
+    if not operations:
+        print("Неверный выбор. Использую ИНВЕРСИЮ")
+        operations = [Operation(ProcessingType.INVERT)]
     
-    #создаем collector
-    collector = ResultCollector(result_queue, NUM_TASKS)
+    #выбираем режим выполнения
+    print("\nВыберите режим выполнения:")
+    print("1 - Потоки (все в одном процессе)")
+    print("2 - Пул процессов (обход GIL)")
+    print("3 - Конвейер по этапам (отдельные пулы для чтения, декодирования, эффектов, кодирования, записи)")
     
-    #запуск
-    print("\n" + "="*60)
-    print("ЗАПУСК ПОТОКОВ")
-    print("="*60)
+    backend_choice = input("Ваш выбор (1-3): ").strip()
     
-    #запускаем producer
-    producer.start()
+    if backend_choice == "2":
+        execution = ExecutionMode.PROCESSES
+        print("Выбран: ПУЛ ПРОЦЕССОВ")
+    elif backend_choice == "3":
+        execution = ExecutionMode.PIPELINE
+        print("Выбран: КОНВЕЙЕР")
+    else:
+        execution = ExecutionMode.THREADS
+        print("Выбраны: ПОТОКИ")
     
-    #запускаем consumers
-    for consumer in consumers:
-        consumer.start()
+    #выбираем режим производителя
+    print("\nВыберите источник задач:")
+    print(f"1 - Случайная выборка ({NUM_TASKS} задач)")
+    print("2 - Все файлы папки (включая подпапки) по одному разу")
     
-    #ждем завершения producer
-    producer.join()
-    print("\n[MAIN] Producer завершил работу")
+    mode_choice = input("Ваш выбор (1-2): ").strip()
     
-    #ждем пока очередь задач опустеет
-    time.sleep(2)
+    if mode_choice == "2":
+        mode = ProducerMode.ALL
+        num_tasks = None #сколько найдется
+        num_producers = NUM_PRODUCERS
+        print("Выбраны: ВСЕ ФАЙЛЫ")
+    else:
+        mode = ProducerMode.RANDOM
+        num_tasks = NUM_TASKS
+        num_producers = 1 #случайной выборке нужен полный список - его строит один производитель
+        print("Выбрана: СЛУЧАЙНАЯ ВЫБОРКА")
+    
+    #общий кэш результатов - одинаковые исходник и цепочка считаются один раз
+    result_cache = ResultCache(CACHE_MEMORY, CACHE_FOLDER)
+    #общий кэш декодированных исходников - разные цепочки над одним файлом декодируют его один раз
+    image_cache = DecodedImageCache(IMAGE_CACHE_MEMORY)
     
-    #останавливаем consumers
-    print("\n[MAIN] Останавливаем consumers...")
-    for consumer in consumers:
-        consumer.stop()
+    sink = PackSink(OUTPUT_FOLDER) if PACK_OUTPUT else FileSink()
+    journal = CompletionJournal(JOURNAL_FILE) if JOURNAL_FILE else None
+    if journal is not None and len(journal):
+        print(f"Журнал {JOURNAL_FILE}: выполнено ранее {len(journal)} задач")
     
-    #ждем завершения consumers
-    for consumer in consumers:
-        consumer.join()
+    #запуск
+    print("\n" + "="*60)
+    print("ЗАПУСК ПОТОКОВ")
+    print("="*60)
     
-    #собираем результаты
-    collector.collect()
+    try:
+        collector, wall_time, cores = run_batch(
+            INPUT_FOLDER, OUTPUT_FOLDER, operations, num_tasks, mode, num_producers, NUM_CONSUMERS,
+            execution, pipeline_workers=PIPELINE_WORKERS, result_cache=result_cache,
+            image_cache=image_cache, tile_memory=TILE_MEMORY, metrics_file=METRICS_FILE,
+            autoscale=AUTOSCALE, min_consumers=MIN_CONSUMERS, max_consumers=MAX_CONSUMERS, sink=sink,
+            journal=journal, scheduling=SCHEDULING, max_pixels=MAX_PIXELS)
+    except OSError as e: #нет папки исходников, нет доступа, битый архив
+        print(f"\nОшибка источника {INPUT_FOLDER}: {e}")
+        return
     
     #выводим статистику
-    collector.print_stats()
+    collector.print_stats(wall_time, cores)
+    print(f"Кэш изображений: попаданий {image_cache.hit_rate:.0%}, "
+          f"в памяти {image_cache.resident_bytes / 1024 / 1024:.1f} МБ")
     
     print("\n" + "="*60)
     print("ПРОГРАММА ЗАВЕРШЕНА")
@@ -358,4 +2867,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#сетевая очередь задач: один брокер (TCP) и воркеры на нескольких машинах делят один запуск.
+#RemoteQueue повторяет интерфейс BlockingQueue (put/get/task_done/close/size/retire_one), поэтому
+#Producer, Consumer и ResultCollector из image_processor работают с ней без изменений.
+#
+#протокол - по строке JSON на запрос и ответ. задачи выдаются в аренду (lease): пока воркер не подтвердил
+#выполнение через task_done, задача числится за его соединением. если соединение оборвалось (воркер упал)
+#или аренда просрочена - задача возвращается в начало очереди и достанется другому воркеру.
+#доставка "хотя бы один раз": после сбоя задача может выполниться повторно (имена результатов детерминированы).
+#
+#запуск:
+#  python network_queue.py coordinator --input input_images --output output_images --ops invert+blur:radius=3
+#  python network_queue.py worker --broker 127.0.0.1:8765 --consumers 3   (на каждой машине, сколько угодно)
+#пути к исходникам и результатам у всех узлов должны совпадать (общее хранилище или одинаковая копия архива)
+#
+#граница доверия: кто может подключиться к брокеру, тот управляет запуском - ставит задачи с любыми путями
+#исходников и результатов (воркеры читают и пишут файлы по ним), забирает чужие задачи и результаты.
+#поэтому брокер по умолчанию слушает только 127.0.0.1, а для других машин нужен явный --host и общий
+#секрет в переменной окружения NETWORK_QUEUE_SECRET (одинаковый у координатора и воркеров). при подключении
+#брокер шлет случайный вызов, клиент отвечает HMAC от него - сам секрет по сети не передается.
+#трафик не шифруется: в недоверенной сети брокер нужно держать за VPN или SSH-туннелем
+import argparse #параметры командной строки
+import hashlib
+import hmac #проверка общего секрета при подключении
+import ipaddress #брокер слушает только localhost или открыт в сеть
+import itertools #номера аренд и соединений
+import json #протокол
+import logging
+import os
+import secrets #случайный вызов для проверки секрета
+import socket
+import socketserver #многопоточный TCP-сервер брокера
+import threading
+import time
+from collections import deque
+
+import image_processor as ip #задачи, результаты, производители, потребители
+
+logger = logging.getLogger("network_queue")
+
+DEFAULT_PORT = 8765
+SECRET_ENV = "NETWORK_QUEUE_SECRET" #общий секрет брокера и его клиентов
+HANDSHAKE_TIMEOUT = 10.0 #сколько брокер ждет ответа на вызов, секунд
+
+
+def encode_item(item): #ImageTask/TaskResult -> словарь для JSON
+    if isinstance(item, ip.ImageTask):
+        return {"task": item.to_dict()}
+    return {"result": item.to_dict()}
+
+
+def decode_item(data):
+    if "task" in data:
+        return ip.ImageTask.from_dict(data["task"])
+    return ip.TaskResult.from_dict(data["result"])
+
+
+def sign_challenge(secret, challenge): #ответ на вызов брокера: HMAC, а не сам секрет
+    return hmac.new((secret or "").encode(), challenge.encode(), hashlib.sha256).hexdigest()
+
+
+def parse_address(text): #"host:port" -> (host, port)
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class BrokerQueue: #одна именованная очередь на брокере: ожидающие элементы + выданные в аренду
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        self.pending = deque() #элементы в JSON-виде - брокеру не нужно их понимать
+        self.leases = {} #номер аренды -> (элемент, владелец-соединение, время выдачи)
+        self.lease_ids = itertools.count(1)
+        self.cond = threading.Condition()
+        self.unfinished = 0 #положенные элементы без подтверждения
+        self.active = True
+
+    def put(self, items): #блокируется, пока нет места (обратное давление на производителей)
+        with self.cond:
+            for item in items:
+                while self.active and self.maxsize > 0 and len(self.pending) >= self.maxsize:
+                    self.cond.wait()
+                if not self.active:
+                    raise Exception("Очередь закрыта")
+                self.pending.append(item)
+                self.unfinished += 1
+                self.cond.notify_all()
+
+    #до max_items элементов. lease=False - элемент сразу считается выполненным (очередь результатов).
+    #возвращает (элементы, done): done - очередь закрыта, пуста и аренд нет, больше ничего не будет.
+    #пока есть аренды, очередь не закончена: упавший воркер вернет свои задачи
+    def get(self, max_items, lease, owner, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while not self.pending:
+                if not self.active and not self.leases:
+                    return [], True
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return [], False
+                self.cond.wait(remaining)
+            items = []
+            while self.pending and len(items) < max_items:
+                item = self.pending.popleft()
+                if lease:
+                    lease_id = next(self.lease_ids)
+                    self.leases[lease_id] = (item, owner, time.monotonic())
+                else:
+                    lease_id = None
+                    self.unfinished -= 1
+                items.append([lease_id, item])
+            self.cond.notify_all() #место освободилось
+            return items, False
+
+    def ack(self, lease_ids): #task_done: аренда закрыта, элемент выполнен
+        with self.cond:
+            for lease_id in lease_ids:
+                if self.leases.pop(lease_id, None) is not None: #просроченную и выданную заново аренду не считаем
+                    self.unfinished -= 1
+            self.cond.notify_all()
+
+    #возвращает элементы в начало очереди: аренды владельца (соединение оборвалось),
+    #указанные номера (воркер отказался от предвыбранных) или просроченные
+    def release(self, owner=None, lease_ids=None, older_than=None):
+        with self.cond:
+            expired = [lease_id for lease_id, (_, lease_owner, leased_at) in self.leases.items()
+                       if (owner is not None and lease_owner == owner)
+                       or (lease_ids is not None and lease_id in lease_ids)
+                       or (older_than is not None and leased_at < older_than)]
+            for lease_id in sorted(expired, reverse=True): #appendleft в обратном порядке сохраняет исходный
+                item, _, _ = self.leases.pop(lease_id)
+                self.pending.appendleft(item)
+            if expired:
+                self.cond.notify_all()
+            return len(expired)
+
+    def join(self):
+        with self.cond:
+            while self.unfinished > 0:
+                self.cond.wait()
+
+    def close(self):
+        with self.cond:
+            self.active = False
+            self.cond.notify_all()
+
+    def size(self):
+        with self.cond:
+            return len(self.pending)
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler): #одно соединение клиента - свой поток на брокере
+    def handle(self):
+        broker = self.server.broker
+        owner = next(broker.connection_ids)
+        try:
+            if not self.authenticate(broker):
+                logger.warning("[BROKER] Отклонено подключение %s:%d: неверный секрет", *self.client_address[:2])
+                return
+            for line in self.rfile:
+                request = json.loads(line)
+                try:
+                    response = broker.dispatch(request, owner)
+                except Exception as e:
+                    response = {"error": str(e)}
+                self.wfile.write((json.dumps(response) + "\n").encode())
+                self.wfile.flush()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            returned = broker.release_owner(owner)
+            if returned:
+                logger.warning("[BROKER] Соединение %d закрыто, возвращено в очередь задач: %d", owner, returned)
+
+    def authenticate(self, broker): #вызов-ответ до первого запроса; без секрета брокер принимает любой ответ
+        challenge = secrets.token_hex(16)
+        self.wfile.write((json.dumps({"challenge": challenge}) + "\n").encode())
+        self.wfile.flush()
+        self.request.settimeout(HANDSHAKE_TIMEOUT) #молчащий клиент не держит поток брокера
+        line = self.rfile.readline()
+        self.request.settimeout(None)
+        try:
+            answer = str(json.loads(line).get("auth", "")) if line else ""
+        except (ValueError, AttributeError):
+            answer = ""
+        ok = broker.secret is None or hmac.compare_digest(answer, sign_challenge(broker.secret, challenge))
+        self.wfile.write((json.dumps({"ok": True} if ok else {"error": "Неверный секрет брокера"}) + "\n").encode())
+        self.wfile.flush()
+        return ok
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Broker: #TCP-брокер с именованными очередями ("tasks", "results")
+    #secret - общий секрет клиентов (None - без проверки, только для доверенной сети или localhost)
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, maxsizes=None, lease_timeout=600.0, secret=None):
+        self.secret = secret
+        self.maxsizes = maxsizes or {} #ограничение размера по имени очереди, по умолчанию - без ограничения
+        self.lease_timeout = lease_timeout #зависший (но не отключившийся) воркер теряет задачу через это время
+        self.queues = {}
+        self.lock = threading.Lock()
+        self.connection_ids = itertools.count(1)
+        self.server = _Server((host, port), _BrokerHandler)
+        self.server.broker = self
+        self.stopped = threading.Event()
+
+    @property
+    def address(self): #фактический адрес - при port=0 порт выбирает система
+        return self.server.server_address[:2]
+
+    def queue(self, name):
+        with self.lock:
+            if name not in self.queues:
+                self.queues[name] = BrokerQueue(self.maxsizes.get(name, 0))
+            return self.queues[name]
+
+    def dispatch(self, request, owner):
+        queue = self.queue(request["queue"])
+        op = request["op"]
+        if request.get("ack"): #подтверждения приходят вместе со следующим запросом - меньше обменов
+            queue.ack(request["ack"])
+        if op == "put":
+            queue.put(request["items"])
+            return {"ok": True}
+        if op == "get":
+            items, done = queue.get(request.get("max", 1), request.get("lease", True), owner, request.get("timeout"))
+            return {"items": items, "done": done}
+        if op == "ack":
+            return {"ok": True}
+        if op == "release":
+            return {"released": queue.release(lease_ids=set(request["ids"]))}
+        if op == "size":
+            return {"size": queue.size()}
+        if op == "join":
+            queue.join()
+            return {"ok": True}
+        if op == "close":
+            queue.close()
+            return {"ok": True}
+        raise Exception(f"Неизвестная операция: {op}")
+
+    def release_owner(self, owner):
+        with self.lock:
+            queues = list(self.queues.values())
+        return sum(queue.release(owner=owner) for queue in queues)
+
+    def _expire_loop(self): #возвращает в очередь задачи с просроченной арендой
+        while not self.stopped.wait(min(self.lease_timeout / 4, 5.0)):
+            with self.lock:
+                queues = list(self.queues.values())
+            older_than = time.monotonic() - self.lease_timeout
+            for queue in queues:
+                returned = queue.release(older_than=older_than)
+                if returned:
+                    logger.warning("[BROKER] Просрочена аренда, возвращено задач: %d", returned)
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="broker", daemon=True).start()
+        threading.Thread(target=self._expire_loop, name="broker-leases", daemon=True).start()
+        logger.info("[BROKER] Слушаю %s:%d", *self.address)
+        if self.secret is None and not ipaddress.ip_address(self.address[0]).is_loopback:
+            logger.warning("[BROKER] Брокер доступен по сети без секрета (%s): задачи может поставить любой", SECRET_ENV)
+
+    def stop(self):
+        self.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class RemoteQueue: #клиент очереди брокера с интерфейсом BlockingQueue
+    #у каждого потока свое соединение и свой буфер: get забирает у брокера до batch_size задач за раз,
+    #task_done копит подтверждения и отправляет их вместе со следующим запросом.
+    #ожидание на брокере - отрезками по poll_interval, чтобы поток замечал retire_one и досылал подтверждения
+    def __init__(self, address, name, lease=True, batch_size=8, poll_interval=1.0, connect_timeout=30.0,
+                 secret=None):
+        self.address = address
+        self.secret = secret #общий секрет брокера
+        self.name = name
+        self.lease = lease #False - для очереди результатов: читатель один, подтверждения не нужны
+        self.batch_size = batch_size if lease else max(batch_size, 64)
+        self.poll_interval = poll_interval
+        self.connect_timeout = connect_timeout #воркер может стартовать раньше брокера
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.retire_requests = 0
+
+    def _state(self):
+        state = self.local
+        if not hasattr(state, "sock"):
+            deadline = time.monotonic() + self.connect_timeout
+            while True:
+                try:
+                    state.sock = socket.create_connection(self.address)
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.5)
+            state.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            state.file = state.sock.makefile("rwb")
+            self._authenticate(state)
+            state.buffer = deque() #предвыбранные (lease_id, элемент)
+            state.handed = deque() #номера аренд, выданных потоку и еще не отмеченных task_done
+            state.acks = [] #подтверждения, еще не отправленные брокеру
+        return state
+
+    def _authenticate(self, state): #отвечает на вызов брокера; неверный секрет - PermissionError
+        line = state.file.readline()
+        if not line:
+            raise ConnectionError("Брокер закрыл соединение")
+        challenge = json.loads(line)["challenge"]
+        state.file.write((json.dumps({"auth": sign_challenge(self.secret, challenge)}) + "\n").encode())
+        state.file.flush()
+        response = json.loads(state.file.readline() or "{}")
+        if not response.get("ok"):
+            state.file.close()
+            state.sock.close()
+            del state.sock
+            raise PermissionError(response.get("error", "Брокер закрыл соединение"))
+
+    def _call(self, request):
+        state = self._state()
+        request["queue"] = self.name
+        if state.acks:
+            request["ack"], state.acks = state.acks, []
+        state.file.write((json.dumps(request) + "\n").encode())
+        state.file.flush()
+        line = state.file.readline()
+        if not line:
+            raise ConnectionError("Брокер закрыл соединение")
+        response = json.loads(line)
+        if "error" in response:
+            raise Exception(response["error"])
+        return response
+
+    def put(self, item):
+        self._call({"op": "put", "items": [encode_item(item)]})
+
+    #как BlockingQueue.get: элемент или None, когда очередь закрыта и всё выполнено,
+    #по таймауту или если потоку пора завершиться (retire_one)
+    def get(self, timeout=None):
+        state = self._state()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                retire = self.retire_requests > 0
+                if retire:
+                    self.retire_requests -= 1
+            if retire:
+                self._release_buffer(state)
+                return None
+            if state.buffer:
+                lease_id, data = state.buffer.popleft()
+                if self.lease:
+                    state.handed.append(lease_id)
+                return decode_item(data)
+            wait = self.poll_interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return None
+            try:
+                response = self._call({"op": "get", "max": self.batch_size, "lease": self.lease, "timeout": wait})
+            except (ConnectionError, OSError):
+                #брокер остановлен (координатор закончил) или недоступен - работы для этого потока больше нет
+                logger.warning("[QUEUE] Брокер %s:%d недоступен", *self.address)
+                return None
+            state.buffer.extend(response["items"])
+            if not response["items"] and response["done"]:
+                return None
+
+    def _release_buffer(self, state): #поток завершается - предвыбранные задачи отдаем другим
+        ids = [lease_id for lease_id, _ in state.buffer]
+        state.buffer.clear()
+        if ids or state.acks:
+            self._call({"op": "release", "ids": ids})
+
+    def task_done(self):
+        if not self.lease:
+            return
+        state = self._state()
+        state.acks.append(state.handed.popleft())
+        if len(state.acks) >= self.batch_size:
+            self._call({"op": "ack"})
+
+    def join(self): #ждет подтверждения всех положенных задач (от всех воркеров)
+        self._call({"op": "join"})
+
+    def retire_one(self):
+        with self.lock:
+            self.retire_requests += 1
+
+    def close(self):
+        self._call({"op": "close"})
+
+    def size(self):
+        return self._call({"op": "size"})["size"]
+
+    def disconnect(self): #закрывает соединение текущего потока
+        state = self.local
+        if hasattr(state, "sock"):
+            if state.acks:
+                self._call({"op": "ack"})
+            state.file.close()
+            state.sock.close()
+            del state.sock
+
+
+class UniqueResults: #очередь результатов без повторов: после падения воркера задача могла выполниться дважды
+    def __init__(self, queue, on_result=None):
+        self.queue = queue
+        self.on_result = on_result #вызывается один раз на задачу (журнал на координаторе)
+        self.seen = set()
+        self.duplicates = 0
+
+    def get(self, timeout=None):
+        while True:
+            result = self.queue.get(timeout)
+            if result is None or result.task_id not in self.seen:
+                if result is not None:
+                    self.seen.add(result.task_id)
+                    if self.on_result is not None:
+                        self.on_result(result)
+                return result
+            self.duplicates += 1
+            logger.info("[COORDINATOR] Повторный результат задачи #%d пропущен", result.task_id)
+
+    def __getattr__(self, name): #остальное (close, size) - как у исходной очереди
+        return getattr(self.queue, name)
+
+
+class JournaledTasks: #журнал выполненных ведет координатор: воркеры его не видят, отмечаем по собранным результатам
+    def __init__(self, queue, journal):
+        self.queue = queue
+        self.journal = journal
+        self.pending = {} #номер задачи -> задача, поставленная в очередь и еще без результата
+        self.lock = threading.Lock()
+
+    def put(self, task): #производители ставят задачи сюда - запоминаем, что потом записать в журнал
+        if task is not None:
+            with self.lock:
+                self.pending[task.task_id] = task
+        self.queue.put(task)
+
+    def record(self, result): #результат собран: воркер к этому моменту записал его на диск с fsync
+        with self.lock:
+            task = self.pending.pop(result.task_id, None)
+        if task is not None and result.success and result.digest is not None:
+            self.journal.record(task, result.digest)
+
+    def __getattr__(self, name): #close, join, size - как у исходной очереди
+        return getattr(self.queue, name)
+
+
+class WorkerSink(ip.FileSink): #результат каждой задачи - файл, как FileSink
+    #если координатор ведет журнал (у задачи есть input_stat), файл уходит на диск с fsync до отправки
+    #результата - координатор отмечает выполненным только то, что уже не потеряется
+    def write(self, task, data, on_durable=None):
+        ip.write_file(task.output_path, data, durable=on_durable is not None or task.input_stat is not None)
+        if on_durable is not None:
+            on_durable()
+
+
+#запуск с брокером: производители и сборщик результатов здесь, потребители - в воркерах на любых машинах.
+#broker - уже запущенный Broker (например, на port=0, чтобы заранее узнать адрес), иначе создается на host:port.
+#возвращает (collector, wall_time) как run_batch
+def run_coordinator(input_folder, output_folder, operations, host="127.0.0.1", port=DEFAULT_PORT,
+                    num_tasks=None, mode=ip.ProducerMode.ALL, num_producers=1, task_queue_size=64,
+                    lease_timeout=600.0, journal=None, broker=None, secret=None):
+    own_broker = broker is None
+    if own_broker:
+        broker = Broker(host, port, {"tasks": task_queue_size, "results": 256}, lease_timeout, secret)
+        broker.start()
+    host, port = broker.address
+    address = ("127.0.0.1" if host in ("", "0.0.0.0") else host, port)
+    task_queue = RemoteQueue(address, "tasks", secret=broker.secret)
+    on_result = None
+    if journal is not None:
+        task_queue = JournaledTasks(task_queue, journal)
+        on_result = task_queue.record
+    result_queue = UniqueResults(RemoteQueue(address, "results", lease=False, secret=broker.secret), on_result)
+
+    source = ip.open_source(input_folder)
+    scanner = source.scanner()
+    task_ids = itertools.count()
+    producers = [ip.Producer(task_queue, input_folder, output_folder, operations, num_tasks, mode, scanner,
+                             task_ids, producer_id=i + 1, source=source, journal=journal)
+                 for i in range(num_producers if mode == ip.ProducerMode.ALL else 1)]
+    collector = ip.ResultCollector(result_queue, num_tasks)
+
+    start_time = time.time()
+    collector.metrics.start_time = start_time
+    for producer in producers:
+        producer.start()
+    collector_thread = threading.Thread(target=collector.collect, name="collector")
+    collector_thread.start()
+
+    for producer in producers:
+        producer.join()
+    collector.skipped = sum(p.tasks_skipped for p in producers)
+    task_queue.close() #воркеры дочитают очередь и завершатся
+    task_queue.join() #все задачи подтверждены - их результаты уже в очереди результатов
+    logger.info("[COORDINATOR] Все задачи выполнены")
+    result_queue.close()
+    collector_thread.join()
+
+    wall_time = time.time() - start_time
+    if own_broker:
+        broker.stop()
+    if journal is not None:
+        journal.close()
+    ip.close_sources()
+    for producer in producers: #как в run_batch: ошибка обхода источника - ошибка запуска
+        if producer.error is not None:
+            raise producer.error
+    return collector, wall_time
+
+
+#воркер: потребители берут задачи у брокера и возвращают результаты в его очередь результатов.
+#завершается, когда координатор закрыл очередь задач и все задачи выполнены
+def run_worker(address, num_consumers=3, execution=ip.ExecutionMode.THREADS, num_processes=None,
+               batch_size=4, image_cache=None, tile_memory=256 * 1024 * 1024, secret=None):
+    task_queue = RemoteQueue(address, "tasks", batch_size=batch_size, secret=secret)
+    result_queue = RemoteQueue(address, "results", lease=False, secret=secret)
+    backend = ip.ProcessBackend(num_processes) if execution == ip.ExecutionMode.PROCESSES else None
+    tiler = ip.TiledProcessor(tile_memory, backend=backend)
+    sink = WorkerSink() #пишет сразу: к task_done результат уже на диске, подтверждение не теряет работу
+    consumers = [ip.Consumer(i + 1, task_queue, result_queue, backend, None, image_cache, tiler, sink=sink)
+                 for i in range(num_consumers)]
+    for consumer in consumers:
+        consumer.start()
+    for consumer in consumers:
+        consumer.join()
+    tiler.shutdown()
+    if backend is not None:
+        backend.shutdown()
+    ip.close_sources()
+    return sum(c.processed_count for c in consumers)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Обработка изображений на нескольких машинах через брокер")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    coordinator = sub.add_parser("coordinator", help="брокер + производители + сборщик результатов")
+    coordinator.add_argument("--input", default="input_images", help="папка, архив или пакет исходников")
+    coordinator.add_argument("--output", default="output_images", help="папка результатов (общая для воркеров)")
+    coordinator.add_argument("--ops", default="invert", help="цепочка, например invert+blur:radius=3")
+    coordinator.add_argument("--host", default="127.0.0.1",
+                             help="адрес брокера; для воркеров на других машинах - явно, например 0.0.0.0")
+    coordinator.add_argument("--port", type=int, default=DEFAULT_PORT)
+    coordinator.add_argument("--producers", type=int, default=2)
+    coordinator.add_argument("--lease-timeout", type=float, default=600.0, help="секунд до повторной выдачи зависшей задачи")
+    coordinator.add_argument("--journal", help="журнал выполненных задач - повторный запуск их пропустит")
+
+    worker = sub.add_parser("worker", help="потребители, берущие задачи у брокера")
+    worker.add_argument("--broker", default=f"127.0.0.1:{DEFAULT_PORT}", help="host:port брокера")
+    worker.add_argument("--consumers", type=int, default=3)
+    worker.add_argument("--processes", type=int, help="обработка в пуле из N процессов")
+    worker.add_argument("--batch", type=int, default=4, help="сколько задач брать у брокера за раз")
+
+    for command in (coordinator, worker): #после имени команды: network_queue.py worker --log-level INFO
+        command.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(threadName)s %(message)s")
+    secret = os.environ.get(SECRET_ENV) or None #не параметром: командную строку видят все пользователи машины
+    if args.command == "coordinator":
+        collector, wall_time = run_coordinator(args.input, args.output, ip.parse_operations(args.ops),
+                                               args.host, args.port, num_producers=args.producers,
+                                               lease_timeout=args.lease_timeout,
+                                               journal=ip.CompletionJournal(args.journal) if args.journal else None,
+                                               secret=secret)
+        collector.print_stats(wall_time)
+    else:
+        execution = ip.ExecutionMode.PROCESSES if args.processes else ip.ExecutionMode.THREADS
+        processed = run_worker(parse_address(args.broker), args.consumers, execution, args.processes, args.batch,
+                               secret=secret)
+        print(f"Воркер завершен: обработано {processed} задач")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,23 @@
-from PIL import Image, ImageDraw, ImageFont 
+from PIL import Image, ImageDraw, ImageFont, ImageChops, features
 #Image - основной класс для работы с изоражениями (создание,хранение) 
 #ImageDraw - инструмент для рисования на изображениях (фигуры, текст)
+#ImageChops - попиксельные операции над целыми изображениями (сложение, смешивание) - выполняются в C, без циклов python
+#features - проверка, собрана ли PIL с поддержкой WebP
 import os #для работы с файловой системой (проверка существования папки, создание папки)
+import argparse #параметры командной строки для генератора корпуса
+import random #случайные размеры, цвета и фигуры
+import shutil #копирование файлов - дубликаты в корпусе
+
+#расширения файлов для поддерживаемых форматов
+FORMAT_EXTENSIONS = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp"}
+
+
+#диагональный градиент серого: (x/ширина + y/высота) * 255 / 2. строится из двух готовых градиентов PIL
+#вместо цикла putpixel по каждому пикселю
+def diagonal_gradient(size):
+    vertical = Image.linear_gradient('L').resize(size) #0 сверху -> 255 снизу
+    horizontal = Image.linear_gradient('L').transpose(Image.TRANSPOSE).resize(size) #0 слева -> 255 справа
+    return ImageChops.add(horizontal, vertical, scale=2.0) #(h + v) / 2
 
 def create_test_images():
     print("Создаю тестовые изображения...")
@@ -47,10 +63,7 @@ def create_test_images():
             
         else:
             #градиент серого
-            for x in range(300):
-                for y in range(200):
-                    gray = int((x/300 + y/200) * 255 / 2)
-                    img.putpixel((x, y), (gray, gray, gray))
+            img = diagonal_gradient((300, 200)).convert('RGB')
             draw = ImageDraw.Draw(img)
             draw.text((120, 90), "Image 6", fill='red')
         
@@ -62,5 +75,91 @@ def create_test_images():
     
     print("\nСоздано 6 тестовых изображений в папке 'input_images'")
 
+#одно синтетическое изображение: фон из градиентов и шума + случайные фигуры. всё рисует PIL целиком,
+#без попиксельных циклов, поэтому большие разрешения создаются быстро
+def synthetic_image(size, mode, rng):
+    width, height = size
+    background = Image.merge('RGB', [
+        diagonal_gradient(size),
+        Image.radial_gradient('L').resize(size),
+        Image.effect_noise(size, rng.uniform(20, 80)), #гауссов шум вокруг 128
+    ])
+    img = ImageChops.blend(background, Image.new('RGB', size, tuple(rng.randrange(256) for _ in range(3))), 0.3)
+    draw = ImageDraw.Draw(img)
+    for _ in range(rng.randint(3, 10)):
+        x0, x1 = sorted(rng.randrange(width) for _ in range(2))
+        y0, y1 = sorted(rng.randrange(height) for _ in range(2))
+        color = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.rectangle([x0, y0, x1, y1], fill=color)
+        else:
+            draw.ellipse([x0, y0, x1, y1], fill=color)
+    return img.convert(mode)
+
+
+#генератор корпуса для бенчмарков: count файлов в folder, размеры от min_size до max_size,
+#форматы и режимы выбираются случайно из списков, доля duplicate_ratio файлов - точные копии уже созданных
+def generate_corpus(folder, count, min_size=(300, 200), max_size=(300, 200), formats=("PNG",),
+                    modes=("RGB",), duplicate_ratio=0.0, seed=None):
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(seed) #свой генератор - при одинаковом seed корпус повторяется
+    formats = [f.upper() for f in formats]
+    if "WEBP" in formats and not features.check("webp"):
+        print("PIL собрана без WebP - формат пропущен")
+        formats.remove("WEBP")
+    if not formats:
+        raise ValueError("Нет доступных форматов")
+    
+    created = []
+    for i in range(count):
+        if created and rng.random() < duplicate_ratio:
+            #дубликат: то же содержимое под другим именем
+            source = rng.choice(created)
+            path = os.path.join(folder, f"img_{i:06d}_dup{os.path.splitext(source)[1]}")
+            shutil.copyfile(source, path)
+            continue
+        
+        size = (rng.randint(min_size[0], max_size[0]), rng.randint(min_size[1], max_size[1]))
+        fmt = rng.choice(formats)
+        mode = rng.choice(modes)
+        if fmt == "JPEG" and mode not in ("RGB", "L", "CMYK"):
+            mode = "RGB" #JPEG не хранит прозрачность
+        img = synthetic_image(size, mode, rng)
+        path = os.path.join(folder, f"img_{i:06d}{FORMAT_EXTENSIONS[fmt]}")
+        img.save(path, format=fmt)
+        created.append(path)
+    
+    print(f"Создано {count} изображений в папке '{folder}' (дубликатов: {count - len(created)})")
+    return created
+
+
+#"800x600" -> (800, 600)
+def parse_size(text):
+    width, _, height = text.lower().partition("x")
+    return int(width), int(height)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Генератор тестовых изображений")
+    parser.add_argument("--output", default="input_images", help="папка для изображений")
+    parser.add_argument("--count", type=int, help="сколько изображений создать (без параметра - 6 стандартных)")
+    parser.add_argument("--min-size", type=parse_size, default=(300, 200), help="минимальный размер, например 300x200")
+    parser.add_argument("--max-size", type=parse_size, default=(300, 200), help="максимальный размер, например 4000x3000")
+    parser.add_argument("--formats", default="PNG", help="форматы через запятую: PNG,JPEG,WEBP")
+    parser.add_argument("--modes", default="RGB", help="цветовые режимы через запятую: RGB,L,RGBA")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0, help="доля файлов-дубликатов (0-1)")
+    parser.add_argument("--seed", type=int, help="зерно генератора случайных чисел")
+    parser.add_argument("--pack", help="дополнительно упаковать изображения в пакет (папка с index.jsonl и сегментами)")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__": #проверка если файл запущен напрямую, а не импортирован как модуль
-    create_test_images()
+    args = parse_args()
+    if args.count is None:
+        create_test_images()
+    else:
+        generate_corpus(args.output, args.count, args.min_size, args.max_size,
+                        args.formats.split(","), args.modes.split(","), args.duplicate_ratio, args.seed)
+    if args.pack:
+        from image_processor import build_pack #упаковка в формате PackSink - для чтения через отображение в память
+        print(f"Упаковано в {args.pack}: {build_pack(args.output, args.pack)} файлов")
@@ -0,0 +1,87 @@
+#брокер на localhost и несколько воркеров-процессов: один воркер убивается посреди запуска,
+#его задачи достаются остальным - каждая задача должна быть выполнена и учтена ровно один раз
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+import image_processor as ip
+import network_queue as nq
+
+NUM_IMAGES = 60
+NUM_WORKERS = 3
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_images(folder, count):
+    os.makedirs(folder)
+    for i in range(count):
+        Image.new("RGB", (320, 240), (i * 4 % 256, 80, 160)).save(os.path.join(folder, f"img_{i:03d}.png"))
+
+
+def saved_files(folder): #готовые результаты, без временных файлов оборванной записи
+    if not os.path.isdir(folder):
+        return []
+    return [name for name in os.listdir(folder) if ".tmp-" not in name]
+
+
+def test_worker_killed_mid_run(tmp_path):
+    input_folder = str(tmp_path / "input")
+    output_folder = str(tmp_path / "output")
+    make_images(input_folder, NUM_IMAGES)
+    journal = ip.CompletionJournal(str(tmp_path / "journal.jsonl"))
+
+    broker = nq.Broker("127.0.0.1", 0, {"tasks": 16, "results": 256})
+    broker.start()
+    host, port = broker.address
+    workers = [subprocess.Popen([sys.executable, os.path.join(HERE, "network_queue.py"), "worker",
+                                 "--broker", f"{host}:{port}", "--consumers", "2", "--batch", "2"], cwd=HERE)
+               for _ in range(NUM_WORKERS)]
+    outcome = {}
+    coordinator = threading.Thread(target=lambda: outcome.update(result=nq.run_coordinator(
+        input_folder, output_folder, ip.parse_operations("blur:radius=4+invert"), journal=journal, broker=broker)))
+    try:
+        coordinator.start()
+        deadline = time.monotonic() + 60
+        while len(saved_files(output_folder)) < 5: #запуск идет - убиваем воркер, держащий задачи в аренде
+            assert time.monotonic() < deadline, "воркеры не начали обработку"
+            time.sleep(0.05)
+        workers[0].kill()
+        assert len(saved_files(output_folder)) < NUM_IMAGES, "воркер убит уже после конца запуска"
+
+        coordinator.join(120)
+        assert not coordinator.is_alive(), "координатор не дождался задач убитого воркера"
+        for worker in workers[1:]:
+            assert worker.wait(30) == 0
+    finally:
+        broker.stop()
+        for worker in workers:
+            if worker.poll() is None:
+                worker.kill()
+            worker.wait()
+
+    collector, _ = outcome["result"]
+    assert sorted(r.task_id for r in collector.results) == list(range(NUM_IMAGES))
+    assert all(r.success for r in collector.results)
+    assert len(saved_files(output_folder)) == NUM_IMAGES
+    assert len(ip.CompletionJournal(str(tmp_path / "journal.jsonl"))) == NUM_IMAGES
+
+
+def test_broker_rejects_wrong_secret():
+    broker = nq.Broker("127.0.0.1", 0, secret="s3cret")
+    broker.start()
+    try:
+        intruder = nq.RemoteQueue(broker.address, "tasks", secret="guess")
+        with pytest.raises(PermissionError):
+            intruder.size()
+        anonymous = nq.RemoteQueue(broker.address, "tasks")
+        with pytest.raises(PermissionError):
+            anonymous.size()
+        assert broker.queue("tasks").size() == 0
+        assert nq.RemoteQueue(broker.address, "tasks", secret="s3cret").size() == 0
+    finally:
+        broker.stop()